@@ -7,24 +7,52 @@ from flask import (
     Response,
     jsonify,
     send_from_directory,
-    stream_with_context
+    stream_with_context,
+    send_file,
+    g
 )
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import xml.etree.ElementTree as ET
-from datetime import datetime
+from datetime import datetime, timezone
 import re
 import os
+import json
 import tempfile
 from dotenv import load_dotenv
-import subprocess
 import threading
+import heapq
+import random
+import statistics
+import time
+from collections import OrderedDict
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 import shutil
+import subprocess
+import signal
 from werkzeug.serving import run_simple
 import hashlib
+import socket
+import uuid
+import gzip
+from xml.sax.saxutils import escape as xml_escape
 import logging
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.orm import deferred
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from datetime import timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from flask_cors import CORS
+from extractor import ExtractorPool, ExtractorError
+from metrics import Histogram, format_family
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional; sin él solo se sirve gzip
+    brotli = None
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -45,16 +73,58 @@ CORS(
 )
 app.secret_key = os.getenv("SECRET_KEY", "dev-secret-key")
 YOUTUBE_API_KEY = os.getenv("YOUTUBE_API_KEY")
+YOUTUBE_API_BASE_URL = os.getenv(
+    "YOUTUBE_API_BASE_URL", "https://www.googleapis.com/youtube/v3"
+).rstrip("/")
+
+# Cliente HTTP compartido para la API de YouTube
+YOUTUBE_API_CONNECT_TIMEOUT = float(os.getenv("YOUTUBE_API_CONNECT_TIMEOUT", 5))
+YOUTUBE_API_READ_TIMEOUT = float(os.getenv("YOUTUBE_API_READ_TIMEOUT", 15))
+YOUTUBE_API_MAX_RETRIES = int(os.getenv("YOUTUBE_API_MAX_RETRIES", 3))
+YOUTUBE_API_MAX_RETRY_AFTER = float(os.getenv("YOUTUBE_API_MAX_RETRY_AFTER", 10))
+YOUTUBE_API_POOL_SIZE = int(os.getenv("YOUTUBE_API_POOL_SIZE", 10))
 
 # Configuración de base de datos (SQLite)
 app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///podcasts.db"
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 db = SQLAlchemy(app)
 
+# WAL permite leer mientras otro proceso escribe; con synchronous=NORMAL solo
+# se hace fsync en los checkpoints, y busy_timeout espera al lock de escritura
+# en lugar de fallar con "database is locked"
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+
+
+def configure_sqlite(dbapi_connection, connection_record):
+    """Aplicar los PRAGMA de rendimiento a cada conexión nueva."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
 # Crear directorio para almacenar archivos de audio
 AUDIO_CACHE_DIR = os.path.join(os.getcwd(), "audio_cache")
 os.makedirs(AUDIO_CACHE_DIR, exist_ok=True)
 
+# Modo de bitrate constante (opcional): el audio se transcodifica a MP3 CBR de
+# AUDIO_CBR_KBPS, de modo que su tamaño exacto se deduce de la duración y cada
+# byte corresponde a un instante concreto. 0 desactiva el modo.
+AUDIO_CBR_KBPS = int(os.getenv("AUDIO_CBR_KBPS", 0))
+CBR_BYTES_PER_SECOND = AUDIO_CBR_KBPS * 1000 // 8
+
+# Trabajadores yt-dlp persistentes para extracciones y descargas. Las descargas
+# ocupan un trabajador durante minutos, así que el pool debe ser mayor que
+# PREFETCH_WORKERS para que las extracciones de stream_audio no esperen.
+EXTRACTOR_POOL_SIZE = int(os.getenv("EXTRACTOR_POOL_SIZE", 4))
+DOWNLOAD_TIMEOUT = int(os.getenv("DOWNLOAD_TIMEOUT", 1800))
+extractor_pool = ExtractorPool(
+    size=EXTRACTOR_POOL_SIZE,
+    max_jobs=int(os.getenv("EXTRACTOR_MAX_JOBS", 50)),
+    job_timeout=int(os.getenv("EXTRACTOR_JOB_TIMEOUT", 120)),
+)
+
 
 # Modelo de base de datos para almacenar feeds
 class PodcastFeed(db.Model):
@@ -62,8 +132,22 @@ class PodcastFeed(db.Model):
     id = db.Column(db.String(64), primary_key=True)  # hash del URL del canal
     channel_id = db.Column(db.String(100), nullable=False)
     channel_title = db.Column(db.String(200), nullable=False)
-    last_updated = db.Column(db.DateTime, default=datetime.utcnow)
-    rss_content = db.Column(db.Text, nullable=True)  # Contenido cacheado
+    last_updated = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    # Las columnas grandes se cargan solo cuando se usan
+    rss_content = deferred(db.Column(db.Text, nullable=True))  # Contenido cacheado
+    rss_header = deferred(db.Column(db.Text, nullable=True))  # Cabecera del canal (sin items)
+    episodes = deferred(db.Column(db.JSON(none_as_null=True), nullable=True))  # Obsoleto: los episodios viven en Episode
+    etag = db.Column(db.String(64), nullable=True)  # Hash del contenido RSS
+    rss_modified = db.Column(db.DateTime, nullable=True)  # Última vez que cambió el contenido
+    rss_gzip = deferred(db.Column(db.LargeBinary, nullable=True))  # Contenido RSS comprimido con gzip
+    rss_brotli = deferred(db.Column(db.LargeBinary, nullable=True))  # Contenido RSS comprimido con brotli
+    rss_layout = db.Column(db.Integer, nullable=True)  # Versión del formato de rss_content (ver FEED_LAYOUT)
+    next_refresh_at = db.Column(db.DateTime, nullable=True)  # Próxima actualización programada
+    last_polled = db.Column(db.DateTime, nullable=True)  # Última petición de un cliente
+    # Última vez que se recorrió la lista de subidas entera (ver sync_videos);
+    # los feeds anteriores a esta columna quedan a None y se recorren en su
+    # próxima actualización
+    last_full_sync = db.Column(db.DateTime, nullable=True, default=datetime.utcnow)
 
 
 # Modelo para videos cacheados
@@ -71,11 +155,29 @@ class CachedVideo(db.Model):
     id = db.Column(db.String(64), primary_key=True)  # ID del video de YouTube
     title = db.Column(db.String(200), nullable=False)
     audio_path = db.Column(db.String(255), nullable=True)  # Ruta al archivo de audio
-    last_accessed = db.Column(db.DateTime, default=datetime.utcnow)
+    last_accessed = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     file_size = db.Column(db.Integer, default=0)  # Tamaño en bytes
     duration = db.Column(db.String(20), default="00:00")  # Duración en formato HH:MM:SS
 
 
+# Modelo para los episodios (videos de la lista de subidas) de cada canal
+class Episode(db.Model):
+    __table_args__ = (
+        db.Index("ix_episode_channel_published", "channel_id", "published_at"),
+    )
+
+    id = db.Column(db.String(64), primary_key=True)  # ID del video de YouTube
+    channel_id = db.Column(db.String(100), nullable=False)  # ID del canal en YouTube
+    title = db.Column(db.String(200), nullable=False)
+    description = db.Column(db.Text, nullable=True)
+    thumbnail = db.Column(db.String(255), nullable=True)
+    published_at = db.Column(db.DateTime, nullable=False)
+    duration = db.Column(db.String(20), default="00:00")  # Duración en formato HH:MM:SS
+    file_size = db.Column(db.Integer, default=0)  # Tamaño en bytes
+    item_xml = db.Column(db.Text, nullable=True)  # Fragmento <item> ya generado
+    item_key = db.Column(db.String(32), nullable=True)  # Hash de los datos del fragmento
+
+
 # Modelo para canales de YouTube
 class YouTubeChannel(db.Model):
     id = db.Column(db.String(64), primary_key=True)  # ID único del canal
@@ -89,9 +191,417 @@ class YouTubeChannel(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # Fecha de actualización
 
 
+# Modelo para el caché persistente de consultas a la API (resolución de
+# handles/URLs y metadatos de canales)
+class LookupCache(db.Model):
+    key = db.Column(db.String(255), primary_key=True)  # "<tipo>:<clave>"
+    value = db.Column(db.JSON, nullable=True)  # None = no existe (caché negativo)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+# Modelo para el progreso de las importaciones OPML (visible desde cualquier proceso)
+class OpmlImport(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    status = db.Column(db.String(20), nullable=False)  # resolving, fetching, building, done, failed
+    progress = db.Column(db.JSON, nullable=False)  # Contadores, feeds creados y errores
+    started_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+
+# Modelo para los leases (locks con caducidad) compartidos entre procesos
+class Lease(db.Model):
+    name = db.Column(db.String(100), primary_key=True)  # "<tipo>:<id>"
+    owner = db.Column(db.String(100), nullable=False)  # Proceso que lo tiene
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+
+# Modelo para la cola persistente de trabajos en segundo plano (ver worker.py)
+class Job(db.Model):
+    __table_args__ = (
+        db.Index("ix_job_claim", "status", "priority", "run_after"),
+        # Solo puede haber un trabajo pendiente o en curso por clave
+        db.Index(
+            "ix_job_dedup_active",
+            "dedup_key",
+            unique=True,
+            sqlite_where=db.text("status IN ('queued', 'running')"),
+        ),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # "refresh", "download" u "opml"
+    target = db.Column(db.String(100), nullable=False)  # ID del feed o del video
+    payload = db.Column(db.JSON, nullable=True)
+    dedup_key = db.Column(db.String(150), nullable=False)
+    priority = db.Column(db.Integer, default=0)  # Mayor = antes
+    status = db.Column(db.String(20), default="queued")  # queued, running, done, dead
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer, default=5)
+    run_after = db.Column(db.DateTime, default=datetime.utcnow)  # Para el backoff
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    locked_by = db.Column(db.String(100), nullable=True)  # Proceso que lo ejecuta
+    lock_expires_at = db.Column(db.DateTime, nullable=True)  # Después se reintenta
+    last_error = db.Column(db.Text, nullable=True)
+
+
+# Modelo para el gasto diario de cuota de la API de YouTube
+class QuotaUsage(db.Model):
+    day = db.Column(db.String(10), primary_key=True)  # Día de cuota (hora del Pacífico)
+    endpoint = db.Column(db.String(50), primary_key=True)
+    feed_id = db.Column(db.String(64), primary_key=True, default="")  # "" = sin feed
+    units = db.Column(db.Integer, default=0)
+    calls = db.Column(db.Integer, default=0)
+
+
+def upgrade_schema():
+    """Añadir a las tablas existentes las columnas e índices nuevos de los modelos.
+
+    ``db.create_all`` solo crea tablas que no existen, así que las bases de
+    datos creadas con versiones anteriores necesitan este paso.
+    """
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as connection:
+                connection.exec_driver_sql(
+                    f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                )
+            logger.info(f"Added column {table.name}.{column.name}")
+
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(db.engine)
+                logger.info(f"Added index {index.name}")
+
+
 # Crear tablas en la base de datos
 with app.app_context():
+    event.listen(db.engine, "connect", configure_sqlite)
     db.create_all()
+    upgrade_schema()
+
+
+class CappedRetry(Retry):
+    """Retry que espera como mucho YOUTUBE_API_MAX_RETRY_AFTER segundos.
+
+    urllib3 duerme lo que diga ``Retry-After``, sin límite; un 429 con una
+    hora de espera bloquearía el hilo durante horas.
+    """
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, YOUTUBE_API_MAX_RETRY_AFTER)
+
+
+def create_api_session():
+    """Crear una sesión HTTP con conexiones persistentes y reintentos.
+
+    Los errores 429 y 5xx se reintentan con backoff exponencial (respetando
+    ``Retry-After`` hasta YOUTUBE_API_MAX_RETRY_AFTER segundos) hasta
+    ``YOUTUBE_API_MAX_RETRIES`` veces.
+    """
+    retry = CappedRetry(
+        total=YOUTUBE_API_MAX_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=YOUTUBE_API_POOL_SIZE,
+        pool_maxsize=YOUTUBE_API_POOL_SIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+api_session = create_api_session()
+
+
+# Presupuesto diario de cuota. YouTube reinicia la cuota a medianoche (hora
+# del Pacífico) y cobra por llamada según el endpoint. Cuando queda menos de
+# QUOTA_RESERVE_UNITS se dejan de hacer las llamadas opcionales (búsquedas,
+# previsualizaciones) para reservar el resto a las actualizaciones de feeds.
+QUOTA_DAILY_BUDGET = int(os.getenv("QUOTA_DAILY_BUDGET", 10000))
+QUOTA_RESERVE_UNITS = int(os.getenv("QUOTA_RESERVE_UNITS", QUOTA_DAILY_BUDGET // 5))
+QUOTA_COSTS = {"search": 100}  # El resto de endpoints de lectura cuestan 1
+QUOTA_SYNC_SECONDS = 30  # Cada cuánto se relee el gasto (otros procesos)
+try:
+    QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")
+except ZoneInfoNotFoundError:  # Imágenes sin tzdata
+    QUOTA_TIMEZONE = timezone(timedelta(hours=-8))
+
+quota_lock = threading.Lock()
+quota_state = {"day": None, "spent": 0, "synced": 0.0, "exhausted": False, "warned": False}
+quota_stats = {"calls": 0, "units": 0, "shed": 0, "rejected": 0}
+# Feed al que se cargan las llamadas hechas en el contexto actual
+quota_feed = contextvars.ContextVar("quota_feed", default="")
+
+
+class QuotaExceeded(Exception):
+    """No queda presupuesto de cuota para esta llamada."""
+
+
+def quota_day():
+    return datetime.now(QUOTA_TIMEZONE).strftime("%Y-%m-%d")
+
+
+def quota_reset_at():
+    """Próximo reinicio de la cuota, en UTC sin zona (como el resto de fechas)."""
+    now = datetime.now(QUOTA_TIMEZONE)
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), QUOTA_TIMEZONE)
+    return midnight.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def sync_quota_state():
+    """Actualizar (con quota_lock tomado) el gasto de hoy desde la base de datos."""
+    day = quota_day()
+    if quota_state["day"] != day:
+        quota_state.update(day=day, spent=0, synced=0.0, exhausted=False, warned=False)
+    if time.monotonic() - quota_state["synced"] > QUOTA_SYNC_SECONDS:
+        with db.engine.connect() as connection:
+            spent = connection.execute(
+                db.select(db.func.sum(QuotaUsage.units)).where(QuotaUsage.day == day)
+            ).scalar()
+        quota_state["spent"] = max(quota_state["spent"], spent or 0)
+        quota_state["synced"] = time.monotonic()
+    return day
+
+
+def quota_remaining():
+    """Unidades que quedan hoy (0 si YouTube ya ha dicho que se agotaron)."""
+    with quota_lock:
+        sync_quota_state()
+        if quota_state["exhausted"]:
+            return 0
+        return max(QUOTA_DAILY_BUDGET - quota_state["spent"], 0)
+
+
+def quota_shedding():
+    """Indicar si hay que renunciar a las llamadas opcionales."""
+    return quota_remaining() < QUOTA_RESERVE_UNITS
+
+
+def charge_quota(endpoint, optional=False):
+    """Cargar al presupuesto de hoy una llamada a ``endpoint``.
+
+    Lanza QuotaExceeded, sin cargar nada, si la llamada no cabe: las opcionales
+    tienen que dejar intacta la reserva.
+    """
+    cost = QUOTA_COSTS.get(endpoint, 1)
+    with quota_lock:
+        day = sync_quota_state()
+        remaining = 0 if quota_state["exhausted"] else QUOTA_DAILY_BUDGET - quota_state["spent"]
+        if optional and remaining - cost < QUOTA_RESERVE_UNITS:
+            quota_stats["shed"] += 1
+            raise QuotaExceeded(f"skipping optional {endpoint} call, quota is low")
+        if remaining < cost:
+            quota_stats["rejected"] += 1
+            raise QuotaExceeded(f"daily quota exhausted ({QUOTA_DAILY_BUDGET} units)")
+
+        quota_state["spent"] += cost
+        quota_stats["calls"] += 1
+        quota_stats["units"] += cost
+        if not quota_state["warned"] and remaining - cost < QUOTA_RESERVE_UNITS:
+            quota_state["warned"] = True
+            logger.warning(
+                f"YouTube API quota is low: {remaining - cost} of {QUOTA_DAILY_BUDGET} units "
+                "left today, optional calls are disabled"
+            )
+
+    statement = sqlite_insert(QuotaUsage).values(
+        day=day, endpoint=endpoint, feed_id=quota_feed.get(), units=cost, calls=1
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[QuotaUsage.day, QuotaUsage.endpoint, QuotaUsage.feed_id],
+        set_={
+            "units": QuotaUsage.units + statement.excluded.units,
+            "calls": QuotaUsage.calls + 1,
+        },
+    )
+    with db.engine.begin() as connection:
+        connection.execute(statement)
+
+
+def youtube_api_get(endpoint, optional=False, **params):
+    """Hacer una petición GET a la API de datos de YouTube y devolver el JSON.
+
+    Cada llamada se carga al presupuesto diario (ver charge_quota); las
+    marcadas como ``optional`` se descartan primero cuando queda poca cuota.
+    """
+    charge_quota(endpoint, optional)
+    params["key"] = YOUTUBE_API_KEY
+    response = api_session.get(
+        f"{YOUTUBE_API_BASE_URL}/{endpoint}",
+        params=params,
+        timeout=(YOUTUBE_API_CONNECT_TIMEOUT, YOUTUBE_API_READ_TIMEOUT),
+    )
+    data = response.json()
+
+    # Si YouTube dice que la cuota se agotó, no insistir hasta el día siguiente
+    reasons = {error.get("reason") for error in data.get("error", {}).get("errors", [])}
+    if reasons & {"quotaExceeded", "dailyLimitExceeded"}:
+        with quota_lock:
+            quota_state["exhausted"] = True
+        logger.warning("YouTube reported the daily API quota as exhausted")
+    return data
+
+
+# Caché de dos niveles (LRU en memoria + tabla LookupCache) para las consultas
+# que casi nunca cambian. Cada tipo tiene su TTL; los "no encontrado" se
+# guardan menos tiempo. Los errores de la API no se guardan.
+LOOKUP_CACHE_SIZE = int(os.getenv("LOOKUP_CACHE_SIZE", 1024))
+LOOKUP_TTLS = {
+    "handle": timedelta(hours=int(os.getenv("HANDLE_CACHE_TTL_HOURS", 24 * 30))),
+    "custom": timedelta(hours=int(os.getenv("HANDLE_CACHE_TTL_HOURS", 24 * 30))),
+    "channel": timedelta(hours=int(os.getenv("CHANNEL_CACHE_TTL_HOURS", 6))),
+}
+LOOKUP_NEGATIVE_TTL = timedelta(hours=int(os.getenv("LOOKUP_NEGATIVE_TTL_HOURS", 1)))
+
+lookup_memory = OrderedDict()  # clave -> (valor, caducidad)
+lookup_lock = threading.Lock()
+lookup_stats = {"memory_hits": 0, "db_hits": 0, "misses": 0, "negative_hits": 0}
+
+
+class YouTubeAPIError(Exception):
+    """La API de YouTube respondió con un error (cuota, clave, etc.)."""
+
+
+def check_api_response(data):
+    """Lanzar YouTubeAPIError si la respuesta de la API es un error."""
+    if "error" in data:
+        raise YouTubeAPIError(data["error"].get("message", "unknown error"))
+    return data
+
+
+def remember_lookup(key, value, expires_at):
+    """Guardar una entrada en el LRU en memoria."""
+    with lookup_lock:
+        lookup_memory[key] = (value, expires_at)
+        lookup_memory.move_to_end(key)
+        while len(lookup_memory) > LOOKUP_CACHE_SIZE:
+            lookup_memory.popitem(last=False)
+
+
+def peek_lookup(kind, name):
+    """Buscar en el caché de dos niveles sin llamar a la API.
+
+    Devuelve ``(encontrado, valor)``; el valor puede ser None si se guardó un
+    "no encontrado".
+    """
+    key = f"{kind}:{name}"
+    now = datetime.utcnow()
+
+    with lookup_lock:
+        entry = lookup_memory.get(key)
+        if entry and entry[1] > now:
+            lookup_memory.move_to_end(key)
+            lookup_stats["memory_hits"] += 1
+            if entry[0] is None:
+                lookup_stats["negative_hits"] += 1
+            return True, entry[0]
+
+    with db.engine.connect() as connection:
+        row = connection.execute(
+            db.select(LookupCache.value, LookupCache.expires_at).where(
+                LookupCache.key == key, LookupCache.expires_at > now
+            )
+        ).first()
+    if row:
+        remember_lookup(key, row.value, row.expires_at)
+        with lookup_lock:
+            lookup_stats["db_hits"] += 1
+            if row.value is None:
+                lookup_stats["negative_hits"] += 1
+        return True, row.value
+
+    with lookup_lock:
+        lookup_stats["misses"] += 1
+    return False, None
+
+
+def cached_lookup(kind, name, fetch):
+    """Devolver el resultado de ``fetch()`` pasando por el caché de dos niveles.
+
+    Se consulta primero la memoria y después SQLite; solo si ambos fallan se
+    llama a ``fetch``. Un resultado None se guarda como negativo durante
+    LOOKUP_NEGATIVE_TTL; las excepciones de ``fetch`` se propagan sin guardar
+    nada.
+    """
+    found, value = peek_lookup(kind, name)
+    if found:
+        return value
+    return store_lookup(kind, name, fetch())
+
+
+def store_lookup(kind, name, value):
+    """Guardar un resultado en los dos niveles del caché y devolverlo."""
+    key = f"{kind}:{name}"
+    now = datetime.utcnow()
+    expires_at = now + (LOOKUP_TTLS[kind] if value is not None else LOOKUP_NEGATIVE_TTL)
+    remember_lookup(key, value, expires_at)
+
+    statement = sqlite_insert(LookupCache).values(key=key, value=value, expires_at=expires_at)
+    statement = statement.on_conflict_do_update(
+        index_elements=[LookupCache.key],
+        set_={"value": statement.excluded.value, "expires_at": statement.excluded.expires_at},
+    )
+    with db.engine.begin() as connection:
+        connection.execute(statement)
+    return value
+
+
+def purge_lookup_cache():
+    """Borrar de SQLite las entradas caducadas del caché de consultas."""
+    with db.engine.begin() as connection:
+        result = connection.execute(
+            db.delete(LookupCache).where(LookupCache.expires_at <= datetime.utcnow())
+        )
+    return result.rowcount
+
+
+def search_channel(query):
+    """Buscar un canal por nombre (cuesta 100 unidades de cuota)."""
+    data = check_api_response(
+        youtube_api_get("search", optional=True, part="snippet", q=query, type="channel")
+    )
+    if "items" in data and len(data["items"]) > 0:
+        return data["items"][0]["snippet"]["channelId"]
+    return None
+
+
+def resolve_handle(username):
+    """Resolver un @handle a ID de canal, con búsqueda como último recurso."""
+    # Primero intentar obtener el canal directamente
+    data = check_api_response(youtube_api_get("channels", part="id", forHandle=username))
+
+    # Verificar si obtenemos una respuesta válida
+    if "items" in data and len(data["items"]) > 0:
+        return data["items"][0]["id"]
+
+    # Si no, recurrir a una búsqueda
+    return search_channel(username)
+
+
+CHANNEL_INFO_PARTS = "snippet,contentDetails,statistics"
+# channels.list admite hasta 50 IDs por llamada (1 unidad de cuota)
+CHANNELS_BATCH_SIZE = 50
 
 
 def get_channel_id(url):
@@ -100,7 +610,12 @@ def get_channel_id(url):
         return None
 
     # Manejar diferentes formatos de URL
-    if "youtube.com/channel/" in url:
+    if "channel_id=" in url:
+        # Feed RSS del canal (así aparecen en el OPML de suscripciones de YouTube)
+        match = re.search(r"[?&]channel_id=([^&#]+)", url)
+        if match:
+            return match.group(1)
+    elif "youtube.com/channel/" in url:
         # URL directa de canal
         match = re.search(r"youtube\.com/channel/([^/\?]+)", url)
         if match:
@@ -111,23 +626,10 @@ def get_channel_id(url):
         if match:
             username = match.group(1)
             try:
-                # Primero intentar obtener el canal directamente
-                channel_url = f"https://www.googleapis.com/youtube/v3/channels?part=id&forHandle={username}&key={YOUTUBE_API_KEY}"
-                response = requests.get(channel_url)
-                data = response.json()
-
-                # Verificar si obtenemos una respuesta válida
-                if "items" in data and len(data["items"]) > 0:
-                    return data["items"][0]["id"]
-
-                # Si no, recurrir a una búsqueda
-                search_url = f"https://www.googleapis.com/youtube/v3/search?part=snippet&q={username}&type=channel&key={YOUTUBE_API_KEY}"
-                response = requests.get(search_url)
-                data = response.json()
-
-                if "items" in data and len(data["items"]) > 0:
-                    return data["items"][0]["snippet"]["channelId"]
-
+                # Los handles no distinguen mayúsculas
+                return cached_lookup(
+                    "handle", username.lower(), lambda: resolve_handle(username)
+                )
             except Exception as e:
                 logger.error(f"Error resolviendo @username: {e}")
                 return None
@@ -143,12 +645,9 @@ def get_channel_id(url):
                 return None
 
             # Resolver URL personalizada a ID de canal
-            search_url = f"https://www.googleapis.com/youtube/v3/search?part=snippet&q={custom_name}&type=channel&key={YOUTUBE_API_KEY}"
-            response = requests.get(search_url)
-            data = response.json()
-
-            if "items" in data and len(data["items"]) > 0:
-                return data["items"][0]["snippet"]["channelId"]
+            return cached_lookup(
+                "custom", custom_name.lower(), lambda: search_channel(custom_name)
+            )
         except Exception as e:
             logger.error(f"Error resolviendo URL personalizada: {e}")
             return None
@@ -156,89 +655,224 @@ def get_channel_id(url):
     return None
 
 
-def get_channel_info(channel_id):
-    """Obtener metadatos del canal desde la API de YouTube."""
-    url = f"https://www.googleapis.com/youtube/v3/channels?part=snippet,contentDetails,statistics&id={channel_id}&key={YOUTUBE_API_KEY}"
+def fetch_channel_info(channel_id):
+    """Pedir los metadatos del canal a la API de YouTube (None si no existe)."""
+    data = check_api_response(
+        youtube_api_get("channels", part=CHANNEL_INFO_PARTS, id=channel_id)
+    )
 
-    try:
-        response = requests.get(url)
-        data = response.json()
+    if "items" not in data or len(data["items"]) == 0:
+        return None
 
-        if "items" not in data or len(data["items"]) == 0:
-            return None
+    return channel_info_from_item(data["items"][0])
 
-        channel_data = data["items"][0]
-        uploads_playlist_id = channel_data["contentDetails"]["relatedPlaylists"][
-            "uploads"
-        ]
 
-        return {
-            "title": channel_data["snippet"]["title"],
-            "description": channel_data["snippet"]["description"],
-            "thumbnail": channel_data["snippet"]["thumbnails"]["high"]["url"],
-            "uploads_playlist_id": uploads_playlist_id,
-            "subscriber_count": int(channel_data["statistics"].get("subscriberCount", 0)),
-            "video_count": int(channel_data["statistics"].get("videoCount", 0)),
-            "view_count": int(channel_data["statistics"].get("viewCount", 0)),
-            "published_at": channel_data["snippet"].get("publishedAt", ""),
-            "country": channel_data["snippet"].get("country", ""),
-        }
+def channel_info_from_item(channel_data):
+    """Convertir un elemento de channels.list en el diccionario de metadatos."""
+    uploads_playlist_id = channel_data["contentDetails"]["relatedPlaylists"][
+        "uploads"
+    ]
+
+    return {
+        "title": channel_data["snippet"]["title"],
+        "description": channel_data["snippet"]["description"],
+        "thumbnail": channel_data["snippet"]["thumbnails"]["high"]["url"],
+        "uploads_playlist_id": uploads_playlist_id,
+        "subscriber_count": int(channel_data["statistics"].get("subscriberCount", 0)),
+        "video_count": int(channel_data["statistics"].get("videoCount", 0)),
+        "view_count": int(channel_data["statistics"].get("viewCount", 0)),
+        "published_at": channel_data["snippet"].get("publishedAt", ""),
+        "country": channel_data["snippet"].get("country", ""),
+    }
+
+
+def get_channel_info(channel_id):
+    """Obtener metadatos del canal, desde el caché o la API de YouTube."""
+    try:
+        return cached_lookup("channel", channel_id, lambda: fetch_channel_info(channel_id))
     except Exception as e:
         logger.error(f"Error obteniendo información del canal: {e}")
         return None
 
 
-def get_videos(uploads_playlist_id, max_results=50):
-    """Obtener videos de la lista de reproducción de subidas de un canal."""
-    url = f"https://www.googleapis.com/youtube/v3/playlistItems?part=snippet,contentDetails&maxResults={max_results}&playlistId={uploads_playlist_id}&key={YOUTUBE_API_KEY}"
+def get_channel_infos(channel_ids):
+    """Obtener metadatos de varios canales a la vez.
+
+    Los que no están en el caché se piden con una llamada a channels.list por
+    cada bloque de hasta 50 IDs. Devuelve {channel_id: info}; los canales que
+    no existen quedan como None y los de un bloque que falla no aparecen.
+    """
+    infos = {}
+    missing = []
+    for channel_id in dict.fromkeys(channel_ids):
+        found, info = peek_lookup("channel", channel_id)
+        if found:
+            infos[channel_id] = info
+        else:
+            missing.append(channel_id)
+
+    for start in range(0, len(missing), CHANNELS_BATCH_SIZE):
+        batch = missing[start:start + CHANNELS_BATCH_SIZE]
+        try:
+            data = check_api_response(
+                youtube_api_get("channels", part=CHANNEL_INFO_PARTS, id=",".join(batch))
+            )
+        except Exception as e:
+            logger.error(f"Error obteniendo información de {len(batch)} canales: {e}")
+            continue
+
+        items = {item["id"]: channel_info_from_item(item) for item in data.get("items", [])}
+        for channel_id in batch:
+            infos[channel_id] = store_lookup("channel", channel_id, items.get(channel_id))
+    return infos
+
+
+def format_duration(total_seconds):
+    """Formatear segundos como MM:SS o HH:MM:SS."""
+    hours, remainder = divmod(int(total_seconds), 3600)
+    minutes, seconds = divmod(remainder, 60)
+
+    if hours > 0:
+        return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+def parse_iso_duration(iso_duration):
+    """Convertir una duración ISO 8601 (PT#H#M#S) a segundos."""
+    match = re.search(r"PT(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?", iso_duration or "")
+    if not match:
+        return 0
+
+    hours = int(match.group(1) or 0)
+    mins = int(match.group(2) or 0)
+    secs = int(match.group(3) or 0)
+    return hours * 3600 + mins * 60 + secs
+
+
+def duration_seconds(duration):
+    """Convertir una duración MM:SS o HH:MM:SS a segundos."""
+    seconds = 0
+    for part in (duration or "0").split(":"):
+        seconds = seconds * 60 + int(part or 0)
+    return seconds
+
+
+def cbr_length(duration_secs):
+    """Tamaño exacto en bytes del audio CBR de una duración dada."""
+    return int(duration_secs) * CBR_BYTES_PER_SECOND
+
+
+def cbr_feed_length(video_id, media):
+    """Tamaño CBR del audio de un video, el mismo que anuncia su enclosure.
+
+    Se calcula con la duración guardada en Episode (la de la API de datos, que
+    usa render_item) y no con la de yt-dlp, que puede diferir en un segundo.
+    Solo los videos sin episodio usan la duración de ``media``.
+    """
+    with app.app_context():
+        duration = db.session.query(Episode.duration).filter_by(id=video_id).scalar()
+    if duration and duration_seconds(duration):
+        return cbr_length(duration_seconds(duration))
+    return cbr_length(media.get("duration") or 0)
+
+
+# La API de videos acepta como máximo 50 IDs por llamada
+VIDEOS_BATCH_SIZE = 50
 
+
+def get_video_details(video_ids):
+    """Obtener duración y tamaño estimado de varios videos en lotes.
+
+    Devuelve un diccionario {video_id: (duration, file_size)} usando una
+    llamada a videos.list por cada bloque de hasta 50 IDs. Lanza
+    YouTubeAPIError si la API devuelve un error.
+    """
+    details = {}
+
+    for start in range(0, len(video_ids), VIDEOS_BATCH_SIZE):
+        batch = video_ids[start:start + VIDEOS_BATCH_SIZE]
+        # Un error no puede dejar duraciones a cero: se guardan en Episode
+        # y no se vuelven a pedir
+        video_data = check_api_response(
+            youtube_api_get("videos", part="contentDetails", id=",".join(batch))
+        )
+
+        for video_item in video_data.get("items", []):
+            total_seconds = parse_iso_duration(
+                video_item["contentDetails"].get("duration")
+            )
+            # Estimar tamaño basado en duración (estimación aproximada)
+            file_size = total_seconds * 32000  # Asumiendo audio de 32kbps
+            details[video_item["id"]] = (format_duration(total_seconds), file_size)
+
+    return details
+
+
+def get_videos(uploads_playlist_id, max_results=50, full_history=False, known_ids=None, durations=None):
+    """Obtener videos de la lista de reproducción de subidas de un canal.
+
+    Por defecto solo se lee la primera página. Con ``full_history`` se sigue
+    ``nextPageToken`` hasta el final de la lista; con ``known_ids`` se sigue
+    paginando solo hasta encontrar un video ya conocido, y únicamente se
+    devuelven los videos nuevos. ``durations`` son {video_id: (duration,
+    file_size)} ya conocidos, que no se vuelven a pedir. Lanza
+    YouTubeAPIError o QuotaExceeded si falla alguna llamada a la API.
+    """
     try:
-        response = requests.get(url)
-        data = response.json()
+        items = []
+        page_token = None
+        while True:
+            params = {
+                "part": "snippet,contentDetails",
+                "maxResults": max_results,
+                "playlistId": uploads_playlist_id,
+            }
+            if page_token:
+                params["pageToken"] = page_token
+            # Un error a mitad del historial no debe pasar por el historial
+            # completo: las sincronizaciones siguientes se paran en el
+            # primer video conocido y nunca pedirían los que faltan
+            data = check_api_response(youtube_api_get("playlistItems", **params))
+
+            if "items" not in data:
+                break
+
+            reached_known = False
+            for item in data["items"]:
+                if known_ids and item["contentDetails"]["videoId"] in known_ids:
+                    reached_known = True
+                    break
+                items.append(item)
 
-        if "items" not in data:
-            return []
+            page_token = data.get("nextPageToken")
+            if reached_known or not page_token:
+                break
+            if not full_history and known_ids is None:
+                break
 
         videos = []
-        for item in data["items"]:
+        uncached_ids = []
+        for item in items:
             video_id = item["contentDetails"]["videoId"]
 
-            # Verificar si el video ya está en caché
-            cached_video = CachedVideo.query.get(video_id)
             duration = "00:00"
             file_size = 0
 
-            if cached_video:
+            # Verificar si el video ya está en caché
+            cached_video = None
+            if not (durations and video_id in durations):
+                cached_video = CachedVideo.query.get(video_id)
+
+            if durations and video_id in durations:
+                duration, file_size = durations[video_id]
+            elif cached_video:
                 duration = cached_video.duration
                 file_size = cached_video.file_size
-                # Actualizar último acceso
-                cached_video.last_accessed = datetime.utcnow()
-                db.session.commit()
+                # Actualizar último acceso (se guarda en lote, ver touch_cached_video)
+                touch_cached_video(video_id)
             else:
-                # Obtener información detallada del video (incluyendo duración)
-                video_url = f"https://www.googleapis.com/youtube/v3/videos?part=contentDetails,statistics&id={video_id}&key={YOUTUBE_API_KEY}"
-                video_response = requests.get(video_url)
-                video_data = video_response.json()
-
-                if "items" in video_data and len(video_data["items"]) > 0:
-                    # Convertir duración ISO 8601 a minutos:segundos
-                    iso_duration = video_data["items"][0]["contentDetails"]["duration"]
-                    minutes = re.search(
-                        r"PT(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?", iso_duration
-                    )
-                    if minutes:
-                        hours = int(minutes.group(1) or 0)
-                        mins = int(minutes.group(2) or 0)
-                        secs = int(minutes.group(3) or 0)
-
-                        if hours > 0:
-                            duration = f"{hours:02d}:{mins:02d}:{secs:02d}"
-                        else:
-                            duration = f"{mins:02d}:{secs:02d}"
-
-                    # Estimar tamaño basado en duración (estimación aproximada)
-                    total_seconds = hours * 3600 + mins * 60 + secs
-                    file_size = total_seconds * 32000  # Asumiendo audio de 32kbps
+                # La duración se resuelve después en lote
+                uncached_ids.append(video_id)
 
             # Formatear fecha de publicación
             published_at = item["snippet"]["publishedAt"]
@@ -262,18 +896,282 @@ def get_videos(uploads_playlist_id, max_results=50):
                 }
             )
 
+        # Obtener información detallada de los videos no cacheados (incluyendo duración)
+        if uncached_ids:
+            details = get_video_details(uncached_ids)
+            for video in videos:
+                if video["id"] in details:
+                    video["duration"], video["file_size"] = details[video["id"]]
+
         return videos
+    except (YouTubeAPIError, QuotaExceeded):
+        # Devolver una lista vacía haría pasar una sincronización incompleta
+        # por buena (ver update_feed)
+        raise
     except Exception as e:
         logger.error(f"Error obteniendo videos: {e}")
         return []
 
 
+def sync_videos(channel_id, uploads_playlist_id, full_sync=False):
+    """Sincronizar los episodios de un canal con su lista de subidas.
+
+    La primera sincronización recorre todo el historial. Las siguientes solo
+    piden páginas hasta llegar a un video ya conocido y añaden los nuevos
+    delante de los almacenados. Los videos nuevos se guardan en Episode.
+
+    Con ``full_sync`` se vuelve a recorrer la lista entera (sin volver a pedir
+    las duraciones ya guardadas) y se borran de Episode los videos que ya no
+    están en ella: borrados o hechos privados en YouTube. Si la lista llega
+    vacía no se borra nada y se devuelve una lista vacía.
+    """
+    stored_videos = load_episodes(channel_id)
+    if not stored_videos:
+        new_videos = get_videos(uploads_playlist_id, full_history=True)
+    elif full_sync:
+        durations = {video["id"]: (video["duration"], video["file_size"]) for video in stored_videos}
+        videos = get_videos(uploads_playlist_id, full_history=True, durations=durations)
+        if not videos:
+            return []
+        current_ids = {video["id"] for video in videos}
+        removed_ids = [video["id"] for video in stored_videos if video["id"] not in current_ids]
+        for start in range(0, len(removed_ids), 500):
+            Episode.query.filter(
+                Episode.channel_id == channel_id, Episode.id.in_(removed_ids[start:start + 500])
+            ).delete(synchronize_session=False)
+        if removed_ids:
+            logger.info(f"Removed {len(removed_ids)} videos no longer in {uploads_playlist_id}")
+
+        # Conservar los fragmentos <item> ya generados (ver item_fragment)
+        fragments = {video["id"]: video for video in stored_videos}
+        for video in videos:
+            stored = fragments.get(video["id"])
+            if stored:
+                video["item_xml"], video["item_key"] = stored["item_xml"], stored["item_key"]
+        store_episodes(channel_id, videos)
+        return sort_episodes(videos)
+    else:
+        known_ids = {video["id"] for video in stored_videos}
+        new_videos = get_videos(uploads_playlist_id, known_ids=known_ids)
+        if new_videos:
+            logger.info(f"Found {len(new_videos)} new videos in {uploads_playlist_id}")
+
+    store_episodes(channel_id, new_videos)
+    return sort_episodes(new_videos + stored_videos)
+
+
+# Formato de las fechas de publicación en los diccionarios de video (RFC 822)
+PUB_DATE_FORMAT = "%a, %d %b %Y %H:%M:%S GMT"
+
+
+def sort_episodes(videos):
+    """Ordenar videos como episodes_query: del más reciente al más antiguo y, a igual fecha, por ID."""
+    videos.sort(key=lambda video: video["id"])
+    videos.sort(key=lambda video: datetime.strptime(video["published_at"], PUB_DATE_FORMAT), reverse=True)
+    return videos
+
+
+def episode_dict(episode):
+    """Convertir un Episode en el diccionario de video que usan el RSS y la API."""
+    return {
+        "id": episode.id,
+        "title": episode.title,
+        "description": episode.description or "",
+        "thumbnail": episode.thumbnail or "",
+        "published_at": episode.published_at.strftime(PUB_DATE_FORMAT),
+        "url": f"https://www.youtube.com/watch?v={episode.id}",
+        "duration": episode.duration,
+        "file_size": episode.file_size,
+        "item_xml": episode.item_xml,
+        "item_key": episode.item_key,
+    }
+
+
+def episodes_query(channel_id):
+    """Episodios de un canal, del más reciente al más antiguo (usa el índice)."""
+    return Episode.query.filter_by(channel_id=channel_id).order_by(
+        Episode.published_at.desc(), Episode.id
+    )
+
+
+def load_episodes(channel_id, limit=None, offset=0):
+    """Cargar los episodios de un canal como diccionarios de video."""
+    query = episodes_query(channel_id).offset(offset)
+    if limit is not None:
+        query = query.limit(limit)
+    return [episode_dict(episode) for episode in query]
+
+
+def store_episodes(channel_id, videos):
+    """Insertar o actualizar los episodios de un canal (sin hacer commit).
+
+    También guarda los fragmentos <item> generados, así que conviene llamarla
+    después de generate_rss.
+    """
+    by_id = {video["id"]: video for video in videos}
+    ids = list(by_id)
+    existing = {}
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        for episode in Episode.query.filter(Episode.id.in_(chunk)):
+            existing[episode.id] = episode
+
+    for video_id, video in by_id.items():
+        episode = existing.get(video_id)
+        if not episode:
+            episode = Episode(id=video_id)
+            db.session.add(episode)
+        episode.channel_id = channel_id
+        episode.title = video["title"][:200]
+        episode.description = video.get("description", "")
+        episode.thumbnail = video.get("thumbnail", "")
+        episode.published_at = datetime.strptime(video["published_at"], PUB_DATE_FORMAT)
+        episode.duration = video.get("duration", "00:00")
+        episode.file_size = video.get("file_size", 0)
+        if video.get("item_xml"):
+            episode.item_xml = video["item_xml"]
+            episode.item_key = video["item_key"]
+
+
+def parse_feed_items(rss_content):
+    """Recuperar los videos de los <item> de un RSS generado por generate_rss."""
+    itunes = "{http://www.itunes.com/dtds/podcast-1.0.dtd}"
+    videos = []
+    for item in ET.fromstring(rss_content).iter("item"):
+        url = item.findtext("link", "")
+        enclosure = item.find("enclosure")
+        image = item.find(f"{itunes}image")
+        videos.append({
+            "id": url.rsplit("v=", 1)[-1],
+            "title": item.findtext("title", ""),
+            "description": item.findtext("description") or "",
+            "url": url,
+            "published_at": item.findtext("pubDate", ""),
+            "duration": item.findtext(f"{itunes}duration") or "00:00",
+            "file_size": int(enclosure.get("length", 0)) if enclosure is not None else 0,
+            "thumbnail": image.get("href", "") if image is not None else "",
+        })
+    return videos
+
+
+def migrate_feed_episodes():
+    """Pasar a Episode los episodios guardados en la columna JSON de los feeds."""
+    feeds = PodcastFeed.query.filter(PodcastFeed.episodes.isnot(None)).all()
+    for feed in feeds:
+        if feed.episodes:
+            store_episodes(feed.channel_id, feed.episodes)
+            logger.info(f"Migrated {len(feed.episodes)} episodes of feed {feed.id}")
+        feed.episodes = None
+        db.session.commit()
+
+
+def rebuild_feed_layouts():
+    """Regenerar los feeds guardados con un formato anterior a FEED_LAYOUT.
+
+    Los feeds de versiones anteriores no tienen sus episodios en Episode (se
+    recuperan de los <item> de rss_content) o tienen los items en el orden de
+    la lista de subidas. Se regeneran desde Episode para que el feed servido
+    en streaming (iter_stored_rss) sea idéntico a rss_content y a sus copias
+    comprimidas, que comparten ETag.
+    """
+    lease = "migrate:feed-layout"
+    if not acquire_lease(lease, REFRESH_LEASE_TTL):
+        return
+    try:
+        base_url = os.getenv("BASE_URL", "http://localhost:5000").rstrip("/")
+        feeds = PodcastFeed.query.filter(
+            PodcastFeed.rss_content.isnot(None),
+            db.or_(PodcastFeed.rss_layout.is_(None), PodcastFeed.rss_layout != FEED_LAYOUT),
+        ).all()
+        for feed in feeds:
+            try:
+                if not episodes_query(feed.channel_id).first():
+                    store_episodes(feed.channel_id, parse_feed_items(feed.rss_content))
+                header = feed.rss_header or feed_header(feed.rss_content)
+                if "xmlns:atom" not in header:
+                    # Los feeds anteriores a la paginación no declaran atom
+                    header = header.replace(
+                        'xmlns:content="http://purl.org/rss/1.0/modules/content/"',
+                        'xmlns:content="http://purl.org/rss/1.0/modules/content/" '
+                        'xmlns:atom="http://www.w3.org/2005/Atom"',
+                        1,
+                    )
+                videos = load_episodes(feed.channel_id)
+                set_feed_content(feed, "".join(iter_rss(header, videos, base_url)))
+                store_episodes(feed.channel_id, videos)
+                db.session.commit()
+                logger.info(f"Rebuilt feed {feed.id} with {len(videos)} episodes")
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error rebuilding feed {feed.id}: {e}")
+    finally:
+        release_lease(lease)
+
+
+def render_item(video, base_url):
+    """Generar el XML del <item> de un episodio, indentado para el feed."""
+    item = ET.Element("item")
+
+    ET.SubElement(item, "title").text = video["title"]
+    ET.SubElement(item, "description").text = video["description"]
+    ET.SubElement(item, "link").text = video["url"]
+    ET.SubElement(item, "guid").text = video["url"]
+    ET.SubElement(item, "pubDate").text = video["published_at"]
+
+    # Etiquetas específicas de iTunes
+    ET.SubElement(item, "itunes:duration").text = video["duration"]
+
+    # Enclosure - apunta a nuestra API de streaming de audio
+    enclosure = ET.SubElement(item, "enclosure")
+    audio_url = f"{base_url}/audio/{video['id']}"
+    enclosure.set("url", audio_url)
+    if AUDIO_CBR_KBPS:
+        length = cbr_length(duration_seconds(video["duration"]))
+    else:
+        length = video["file_size"]
+    enclosure.set("length", str(length))
+    enclosure.set("type", "audio/mpeg")
+
+    # Imagen de iTunes (miniatura)
+    if video["thumbnail"]:
+        image = ET.SubElement(item, "itunes:image")
+        image.set("href", video["thumbnail"])
+
+    # Los items van dentro de <rss><channel>, es decir, en el nivel 2
+    ET.indent(item, space="  ", level=2)
+    return ET.tostring(item, encoding="unicode")
+
+
+# Campos del episodio que aparecen en su <item>
+ITEM_FIELDS = ("id", "title", "description", "url", "published_at", "duration", "file_size", "thumbnail")
+
+
+def item_fragment(video, base_url):
+    """Devolver el <item> del episodio, generándolo solo si algo cambió.
+
+    El XML se guarda en el propio diccionario del video (``item_xml``) junto
+    con un hash de los datos de los que depende (``item_key``).
+    """
+    key_data = [video.get(field) for field in ITEM_FIELDS] + [base_url, AUDIO_CBR_KBPS]
+    item_key = hashlib.md5(json.dumps(key_data).encode("utf-8")).hexdigest()
+    if video.get("item_key") != item_key or not video.get("item_xml"):
+        video["item_xml"] = render_item(video, base_url)
+        video["item_key"] = item_key
+    return video["item_xml"]
+
+
 def generate_rss(channel_info, videos, base_url, feed_id):
-    """Generar XML RSS a partir de datos del canal y videos."""
+    """Generar XML RSS a partir de datos del canal y videos.
+
+    Solo se construye con ElementTree la cabecera del canal; los <item> se
+    toman de los fragmentos guardados en cada video (ver item_fragment) y se
+    concatenan en el orden recibido, que debe ser el de sort_episodes.
+    """
     rss = ET.Element("rss")
     rss.set("version", "2.0")
     rss.set("xmlns:itunes", "http://www.itunes.com/dtds/podcast-1.0.dtd")
     rss.set("xmlns:content", "http://purl.org/rss/1.0/modules/content/")
+    rss.set("xmlns:atom", "http://www.w3.org/2005/Atom")
 
     channel = ET.SubElement(rss, "channel")
 
@@ -301,155 +1199,320 @@ def generate_rss(channel_info, videos, base_url, feed_id):
     # Categoría (genérica)
     ET.SubElement(channel, "itunes:category").set("text", "Technology")
 
-    # Añadir elementos (videos)
-    for video in videos:
-        item = ET.SubElement(channel, "item")
+    # Convertir a cadena
+    tree = ET.ElementTree(rss)
+    ET.indent(tree, space="  ", level=0)
 
-        ET.SubElement(item, "title").text = video["title"]
-        ET.SubElement(item, "description").text = video["description"]
-        ET.SubElement(item, "link").text = video["url"]
-        ET.SubElement(item, "guid").text = video["url"]
-        ET.SubElement(item, "pubDate").text = video["published_at"]
+    header = ET.tostring(rss, encoding="utf-8", method="xml").decode("utf-8")
+    header = header[: -len(FEED_CLOSING)]
 
-        # Etiquetas específicas de iTunes
-        ET.SubElement(item, "itunes:duration").text = video["duration"]
+    return "".join(iter_rss(header, videos, base_url))
 
-        # Enclosure - apunta a nuestra API de streaming de audio
-        enclosure = ET.SubElement(item, "enclosure")
-        audio_url = f"{base_url}/audio/{video['id']}"
-        enclosure.set("url", audio_url)
-        enclosure.set("length", str(video["file_size"]))
-        enclosure.set("type", "audio/mpeg")
 
-        # Imagen de iTunes (miniatura)
-        if video["thumbnail"]:
-            image = ET.SubElement(item, "itunes:image")
-            image.set("href", video["thumbnail"])
+# Todo feed generado termina igual; lo anterior es la cabecera del canal
+FEED_CLOSING = "\n  </channel>\n</rss>"
+ITEM_SEPARATOR = "\n    "
+# Versión del formato de rss_content. Con la actual, rss_content es la
+# cabecera más los item_xml de Episode en el orden de episodes_query
+FEED_LAYOUT = 1
+
+
+def feed_header(rss_content):
+    """Extraer la cabecera del canal de un RSS generado por generate_rss."""
+    header = rss_content.split(f"{ITEM_SEPARATOR}<item>", 1)[0]
+    if header.endswith(FEED_CLOSING):
+        header = header[: -len(FEED_CLOSING)]
+    return header
+
+
+def iter_rss(header, videos, base_url, links=()):
+    """Generar el RSS por partes: cabecera, enlaces atom, items y cierre.
+
+    Los items se producen de uno en uno, así que el feed puede enviarse en
+    streaming sin construirlo entero en memoria.
+    """
+    yield header
+    for rel, href in links:
+        yield f'{ITEM_SEPARATOR}<atom:link rel="{rel}" href="{xml_escape(href)}" />'
+    for video in videos:
+        yield ITEM_SEPARATOR + item_fragment(video, base_url)
+    yield FEED_CLOSING
+
+
+def iter_stored_rss(header, channel_id, base_url):
+    """Generar el RSS guardado con los fragmentos de Episode, tal cual están.
+
+    A diferencia de iter_rss no regenera los <item>, así que el resultado es
+    el mismo rss_content (ver FEED_LAYOUT) aunque BASE_URL haya cambiado.
+    """
+    yield header
+    for episode in episodes_query(channel_id).yield_per(200):
+        yield ITEM_SEPARATOR + (episode.item_xml or item_fragment(episode_dict(episode), base_url))
+    yield FEED_CLOSING
+
+
+# Leases entre procesos: con varios trabajadores de gunicorn, cada feed se
+# actualiza y cada audio se descarga en un solo proceso. Un lease caduca a los
+# TTL segundos, así que si su dueño muere otro proceso lo puede tomar; los
+# trabajos largos lo renuevan mientras avanzan. Dentro de un proceso también
+# son exclusivos: un hilo no puede tomar el lease que tiene otro. Todo lo que
+# llena el caché de audio de un video (StreamFill y download_audio) usa el
+# mismo lease, fill_lease(video_id).
+LEASE_OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+REFRESH_LEASE_TTL = timedelta(seconds=int(os.getenv("REFRESH_LEASE_TTL_SECONDS", 600)))
+FILL_LEASE_TTL = timedelta(seconds=int(os.getenv("FILL_LEASE_TTL_SECONDS", 60)))
+LEASE_CHECK_INTERVAL = 5  # Segundos entre comprobaciones del lease de otro proceso
+
+lease_lock = threading.Lock()
+leases_held = set()  # Leases de este proceso
+lease_stats = {"acquired": 0, "contended": 0}
+
+
+def fill_lease(video_id):
+    return f"fill:{video_id}"
+
+
+def acquire_lease(name, ttl):
+    """Tomar el lease ``name`` durante ``ttl``.
+
+    Devuelve False si lo tiene otro hilo de este proceso, o si lo tiene otro
+    proceso y no ha caducado. La comprobación y la escritura en SQLite son
+    una sola sentencia, así que es atómica entre procesos.
+    """
+    with lease_lock:
+        if name in leases_held:
+            lease_stats["contended"] += 1
+            return False
+        leases_held.add(name)
+
+    now = datetime.utcnow()
+    statement = sqlite_insert(Lease).values(name=name, owner=LEASE_OWNER, expires_at=now + ttl)
+    statement = statement.on_conflict_do_update(
+        index_elements=[Lease.name],
+        set_={"owner": statement.excluded.owner, "expires_at": statement.excluded.expires_at},
+        where=(Lease.expires_at <= now) | (Lease.owner == LEASE_OWNER),
+    )
+    acquired = False
+    try:
+        with app.app_context(), db.engine.begin() as connection:
+            acquired = connection.execute(statement).rowcount == 1
+    finally:
+        with lease_lock:
+            if not acquired:
+                leases_held.discard(name)
+            lease_stats["acquired" if acquired else "contended"] += 1
+    return acquired
+
+
+def renew_lease(name, ttl):
+    """Alargar ``ttl`` un lease de este proceso."""
+    with app.app_context(), db.engine.begin() as connection:
+        connection.execute(
+            db.update(Lease)
+            .where(Lease.name == name, Lease.owner == LEASE_OWNER)
+            .values(expires_at=datetime.utcnow() + ttl)
+        )
 
-    # Convertir a cadena
-    tree = ET.ElementTree(rss)
-    ET.indent(tree, space="  ", level=0)
 
-    xml_str = ET.tostring(rss, encoding="utf-8", method="xml")
-    return xml_str.decode("utf-8")
+def release_lease(name):
+    """Soltar un lease de este proceso."""
+    try:
+        with app.app_context(), db.engine.begin() as connection:
+            connection.execute(
+                db.delete(Lease).where(Lease.name == name, Lease.owner == LEASE_OWNER)
+            )
+    finally:
+        with lease_lock:
+            leases_held.discard(name)
+
+
+def lease_held(name):
+    """Indicar si otro hilo u otro proceso tiene ahora el lease ``name``."""
+    with lease_lock:
+        if name in leases_held:
+            return True
+    with app.app_context(), db.engine.connect() as connection:
+        row = connection.execute(
+            db.select(Lease.owner).where(
+                Lease.name == name,
+                Lease.owner != LEASE_OWNER,
+                Lease.expires_at > datetime.utcnow(),
+            )
+        ).first()
+    return row is not None
+
 
+def download_audio(video_id, rate_limit=None):
+    """Descargar audio de un video de YouTube usando yt-dlp.
 
-def download_audio(video_id):
-    """Descargar audio de un video de YouTube usando yt-dlp."""
+    Una sola ejecución de yt-dlp descarga, convierte a MP3 y devuelve los
+    metadatos (título, duración, formato), con los que se guarda la fila de
+    CachedVideo. ``rate_limit`` (bytes/s) limita el ancho de banda.
+    """
     output_path = os.path.join(AUDIO_CACHE_DIR, f"{video_id}.mp3")
 
     if os.path.exists(output_path):
         return output_path
 
+    # Solo se llena el caché una vez, sea con esta descarga o con un StreamFill
+    lease = fill_lease(video_id)
+    if not acquire_lease(lease, timedelta(seconds=DOWNLOAD_TIMEOUT + 60)):
+        logger.info(f"Video {video_id} is already being cached")
+        return None
+
+    # Crear directorio temporal para la descarga
+    temp_dir = tempfile.mkdtemp()
     try:
-        # Crear directorio temporal para la descarga
-        temp_dir = tempfile.mkdtemp()
         temp_output = os.path.join(temp_dir, f"{video_id}.%(ext)s")
 
         # Opciones para extraer solo audio y convertir a MP3
-        cmd = [
-            "yt-dlp",
-            "-f",
-            "bestaudio",
-            "-x",
-            "--audio-format",
-            "mp3",
-            "--audio-quality",
-            "128K",
-            "--embed-thumbnail",
-            "--add-metadata",
-            "-o",
-            temp_output,
-            f"https://www.youtube.com/watch?v={video_id}",
-        ]
+        options = {
+            "format": "bestaudio",
+            "outtmpl": temp_output,
+            "writethumbnail": True,
+            "postprocessors": [
+                {"key": "FFmpegExtractAudio", "preferredcodec": "mp3", "preferredquality": "128"},
+                {"key": "FFmpegMetadata", "add_metadata": True},
+                {"key": "EmbedThumbnail"},
+            ],
+        }
+        if rate_limit:
+            options["ratelimit"] = rate_limit
 
-        # Ejecutar yt-dlp
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = process.communicate()
+        # Ejecutar yt-dlp en el pool de trabajadores
+        try:
+            info = extractor_pool.submit(
+                "download",
+                f"https://www.youtube.com/watch?v={video_id}",
+                options,
+                timeout=DOWNLOAD_TIMEOUT,
+            )
+        except ExtractorError as e:
+            logger.error(f"Error descargando audio: {e}")
+            return None
 
-        if process.returncode != 0:
-            logger.error(f"Error descargando audio: {stderr.decode()}")
+        # Ruta final tras la conversión a MP3
+        downloads = info.get("requested_downloads") or [{}]
+        src_path = downloads[0].get("filepath")
+        if not src_path or not os.path.exists(src_path):
+            src_path = next(
+                (os.path.join(temp_dir, file) for file in os.listdir(temp_dir) if file.endswith(".mp3")),
+                None,
+            )
+        if not src_path:
+            logger.error(f"Error descargando audio: no se generó el MP3 de {video_id}")
             return None
 
         # Mover archivo descargado al directorio de caché
-        for file in os.listdir(temp_dir):
-            if file.endswith(".mp3"):
-                src_path = os.path.join(temp_dir, file)
-                shutil.move(src_path, output_path)
-
-                # Obtener tamaño y duración
-                file_size = os.path.getsize(output_path)
-
-                # Usar ffprobe para obtener la duración
-                duration_cmd = [
-                    "ffprobe",
-                    "-v",
-                    "error",
-                    "-show_entries",
-                    "format=duration",
-                    "-of",
-                    "default=noprint_wrappers=1:nokey=1",
-                    output_path,
-                ]
-
-                duration_process = subprocess.Popen(
-                    duration_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-                )
-                duration_stdout, _ = duration_process.communicate()
-
-                duration_secs = float(duration_stdout.decode().strip())
-                hours, remainder = divmod(int(duration_secs), 3600)
-                minutes, seconds = divmod(remainder, 60)
-
-                if hours > 0:
-                    duration_str = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-                else:
-                    duration_str = f"{minutes:02d}:{seconds:02d}"
-
-                # Guardar información en la base de datos
-                video = CachedVideo.query.get(video_id)
-                if not video:
-                    # Obtener título del video
-                    info_cmd = [
-                        "yt-dlp",
-                        "--skip-download",
-                        "--print",
-                        "title",
-                        f"https://www.youtube.com/watch?v={video_id}",
-                    ]
-
-                    info_process = subprocess.Popen(
-                        info_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-                    )
-                    info_stdout, _ = info_process.communicate()
-                    title = info_stdout.decode().strip()
-
-                    video = CachedVideo(
-                        id=video_id,
-                        title=title,
-                        audio_path=output_path,
-                        file_size=file_size,
-                        duration=duration_str,
-                    )
-                else:
-                    video.audio_path = output_path
-                    video.file_size = file_size
-                    video.duration = duration_str
-                    video.last_accessed = datetime.utcnow()
-
-                db.session.add(video)
-                db.session.commit()
+        shutil.move(src_path, output_path)
+        file_size = os.path.getsize(output_path)
+        duration_str = format_duration(info.get("duration") or 0)
+        logger.info(
+            f"Downloaded {video_id}: {file_size} bytes, {duration_str}, "
+            f"source format {info.get('format_id')} ({info.get('acodec')}, {info.get('abr')}k)"
+        )
 
-                return output_path
+        # Guardar información en la base de datos
+        video = db.session.get(CachedVideo, video_id)
+        if not video:
+            video = CachedVideo(id=video_id, title=info.get("title") or video_id)
+        video.audio_path = output_path
+        video.file_size = file_size
+        video.duration = duration_str
+        video.last_accessed = datetime.utcnow()
 
-        # Limpiar directorio temporal
-        shutil.rmtree(temp_dir)
+        db.session.add(video)
+        db.session.commit()
 
-        return None
+        return output_path
 
     except Exception as e:
         logger.error(f"Error en descarga de audio: {e}")
         return None
+    finally:
+        # Limpiar directorio temporal
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        release_lease(lease)
+
+
+def set_feed_content(feed, rss_content):
+    """Guardar el RSS de un feed junto con su ETag y sus versiones comprimidas.
+
+    Si el contenido no ha cambiado se conservan el ETag y la fecha de
+    modificación, de modo que los clientes sigan recibiendo 304. Los items
+    deben estar en el orden de sort_episodes y guardarse luego con
+    store_episodes (ver FEED_LAYOUT).
+    """
+    data = rss_content.encode("utf-8")
+    etag = hashlib.sha256(data).hexdigest()[:32]
+    feed.rss_layout = FEED_LAYOUT
+    if feed.etag == etag and feed.rss_gzip is not None:
+        return
+
+    feed.rss_content = rss_content
+    feed.rss_header = feed_header(rss_content)
+    feed.etag = etag
+    feed.rss_modified = datetime.utcnow().replace(microsecond=0)
+    feed.rss_gzip = gzip.compress(data, compresslevel=9, mtime=0)
+    feed.rss_brotli = brotli.compress(data) if brotli else None
+
+
+def feed_not_modified(feed):
+    """Comprobar If-None-Match / If-Modified-Since contra el feed guardado."""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(feed.etag)
+    if request.if_modified_since and feed.rss_modified:
+        last_modified = feed.rss_modified.replace(tzinfo=timezone.utc)
+        return last_modified <= request.if_modified_since
+    return False
+
+
+# Métricas de Prometheus (ver /metrics)
+request_latency = Histogram(
+    "podtube_request_duration_seconds",
+    "Time to build the response (streamed bodies excluded), by route.",
+    ("route", "method", "status"),
+)
+stream_lock = threading.Lock()
+stream_stats = {"active": 0, "started": 0, "bytes": 0, "transcoders": 0}
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_latency(response):
+    started = g.get("request_started")
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        request_latency.observe(
+            time.perf_counter() - started, route, request.method, str(response.status_code)
+        )
+    return response
+
+
+def metered_stream(chunks):
+    """Contar un stream de audio como activo y sumar los bytes enviados al acabar."""
+    with stream_lock:
+        stream_stats["active"] += 1
+        stream_stats["started"] += 1
+    sent = 0
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        with stream_lock:
+            stream_stats["active"] -= 1
+            stream_stats["bytes"] += sent
+
+
+@app.before_request
+def reset_quota_feed():
+    """Las llamadas a la API no se cargan a ningún feed hasta que se sepa cuál."""
+    quota_feed.set("")
 
 
 @app.route("/")
@@ -475,120 +1538,1505 @@ def view_feed(feed_id):
     
     logger.info(f"Feed found: {feed.channel_title}")
 
-    # Si el feed tiene más de 1 hora, actualizarlo
-    if (datetime.utcnow() - feed.last_updated) > timedelta(hours=1):
+    record_feed_poll(feed_id)
+
+    # Si ya pasó la próxima actualización programada (o más de 1 hora si no
+    # hay ninguna), actualizarlo
+    if feed_is_stale(feed):
         logger.info(f"Feed {feed_id} is outdated, updating in background")
         # Lanzar actualización en segundo plano
-        thread = threading.Thread(target=update_feed, args=(feed_id,))
-        thread.daemon = True
-        thread.start()
+        schedule_feed_refresh(feed_id)
+
+    # Variantes paginadas (RFC 5005) o con los N episodios más recientes
+    if "page" in request.args or "limit" in request.args:
+        return stream_feed_page(feed)
+
+    if feed_not_modified(feed):
+        response = make_response("", 304)
+    else:
+        # Las copias comprimidas son una fracción del RSS y se sirven tal cual
+        # (comprimir en cada sondeo costaría CPU). Sin compresión el feed se
+        # genera en streaming desde Episode en vez de cargar rss_content; los
+        # feeds aún no regenerados (ver rebuild_feed_layouts) se sirven tal cual
+        accept_encodings = request.accept_encodings
+        if feed.rss_brotli and accept_encodings["br"]:
+            response = make_response(feed.rss_brotli)
+            response.headers["Content-Encoding"] = "br"
+        elif feed.rss_gzip and accept_encodings["gzip"]:
+            response = make_response(feed.rss_gzip)
+            response.headers["Content-Encoding"] = "gzip"
+        elif feed.rss_layout == FEED_LAYOUT and feed.rss_header:
+            base_url = os.getenv("BASE_URL", "http://localhost:5000").rstrip("/")
+            response = Response(
+                stream_with_context(iter_stored_rss(feed.rss_header, feed.channel_id, base_url))
+            )
+        else:
+            response = make_response(feed.rss_content or "")
+        response.headers["Content-Type"] = "application/rss+xml"
 
-    response = make_response(feed.rss_content)
-    response.headers["Content-Type"] = "application/rss+xml"
+    if feed.etag:
+        response.set_etag(feed.etag, weak=True)
+    response.last_modified = feed.rss_modified
+    response.headers["Vary"] = "Accept-Encoding"
     return response
 
 
-def update_feed(feed_id):
-    """Actualizar feed en segundo plano."""
+FEED_PAGE_SIZE = int(os.getenv("FEED_PAGE_SIZE", 100))
+
+
+def stream_feed_page(feed):
+    """Enviar en streaming una página del feed o sus ``limit`` episodios más nuevos.
+
+    Las páginas llevan enlaces atom ``first``/``previous``/``next`` al estilo
+    de los feeds paginados de RFC 5005. ``limit`` va de 1 a FEED_PAGE_SIZE.
+    """
+    base_url = os.getenv("BASE_URL", "http://localhost:5000").rstrip("/")
+    feed_url = f"{base_url}/feed/{feed.id}"
+    header = feed.rss_header or feed_header(feed.rss_content or "")
+
+    links = []
+    if "limit" in request.args:
+        limit = request.args.get("limit", type=int)
+        if limit is None or not 1 <= limit <= FEED_PAGE_SIZE:
+            return jsonify({"error": f"limit must be between 1 and {FEED_PAGE_SIZE}"}), 400
+        selected = load_episodes(feed.channel_id, limit=limit)
+        links.append(("self", f"{feed_url}?limit={limit}"))
+    else:
+        page = request.args.get("page", type=int)
+        if page is None or page < 1:
+            return jsonify({"error": "page must be a positive integer"}), 400
+        start = (page - 1) * FEED_PAGE_SIZE
+        # Se pide un episodio de más para saber si hay página siguiente
+        selected = load_episodes(feed.channel_id, limit=FEED_PAGE_SIZE + 1, offset=start)
+        links.append(("self", f"{feed_url}?page={page}"))
+        links.append(("first", f"{feed_url}?page=1"))
+        if page > 1:
+            links.append(("previous", f"{feed_url}?page={page - 1}"))
+        if len(selected) > FEED_PAGE_SIZE:
+            selected = selected[:FEED_PAGE_SIZE]
+            links.append(("next", f"{feed_url}?page={page + 1}"))
+
+    return Response(
+        stream_with_context(iter_rss(header, selected, base_url, links)),
+        mimetype="application/rss+xml",
+    )
+
+
+def update_feed(feed_id, polls=0):
+    """Actualizar feed en segundo plano.
+
+    Devuelve False si no se pudieron obtener el canal o sus videos. ``polls``
+    son peticiones de clientes contadas en otro proceso (ver enqueue_job).
+    """
     with app.app_context():
         feed = PodcastFeed.query.get(feed_id)
         if not feed:
-            return
+            return True
+
+        # Otro proceso puede haberlo actualizado ya; corregir la cola local
+        if not feed_is_stale(feed):
+            push_refresh(feed.id, refresh_due_at(feed))
+            return True
+
+        if quota_remaining() <= 0:
+            raise QuotaExceeded(f"no quota left to refresh feed {feed_id}")
+        quota_feed.set(feed_id)
 
         channel_info = get_channel_info(feed.channel_id)
         if not channel_info:
-            return
+            return False
 
-        videos = get_videos(channel_info["uploads_playlist_id"])
+        # Cada FULL_SYNC_INTERVAL se recorre la lista entera para quitar los
+        # videos borrados. Sin cuota se lanza QuotaExceeded, que no es un
+        # fallo del feed
+        full_sync = not feed.last_full_sync or datetime.utcnow() - feed.last_full_sync >= FULL_SYNC_INTERVAL
+        try:
+            videos = sync_videos(feed.channel_id, channel_info["uploads_playlist_id"], full_sync)
+        except YouTubeAPIError as e:
+            logger.error(f"Error obteniendo videos del feed {feed_id}: {e}")
+            return False
         if not videos:
-            return
+            return False
+        if full_sync:
+            feed.last_full_sync = datetime.utcnow()
 
         base_url = os.getenv("BASE_URL", "http://localhost:5000").rstrip("/")
         rss_content = generate_rss(channel_info, videos, base_url, feed_id)
 
-        feed.rss_content = rss_content
+        set_feed_content(feed, rss_content)
+        store_episodes(feed.channel_id, videos)
         feed.last_updated = datetime.utcnow()
+        plan_next_refresh(feed, polls)
         db.session.commit()
 
+        # Feeds con oyentes recientes: descargar ya los episodios más nuevos
+        if feed.last_polled and datetime.utcnow() - feed.last_polled < REFRESH_IDLE_AFTER:
+            prefetch_episodes(videos)
+        return True
 
-@app.route("/audio/<video_id>")
-def stream_audio(video_id):
-    """Stream audio directly from YouTube using yt-dlp."""
-    logger.info(f"Streaming audio for video {video_id}")
-    
-    def generate():
-        # Set up yt-dlp command to stream audio
-        cmd = [
-            "yt-dlp",
-            "-f",
-            "bestaudio",
-            "-o",
-            "-",  # Output to stdout
-            "--no-continue",  # Don't resume downloads
-            "--no-part",  # Don't create temporary .part files
-            "--no-playlist",  # Single video only
-            "--quiet",  # Suppress output
-            f"https://www.youtube.com/watch?v={video_id}",
-        ]
 
-        process = None
+# Actualizaciones de feeds en segundo plano: como máximo una por feed a la vez,
+# ejecutadas en un pool acotado
+REFRESH_WORKERS = int(os.getenv("REFRESH_WORKERS", 2))
+REFRESH_QUEUE_LIMIT = int(os.getenv("REFRESH_QUEUE_LIMIT", 100))
+
+refresh_executor = ThreadPoolExecutor(
+    max_workers=REFRESH_WORKERS, thread_name_prefix="feed-refresh"
+)
+refresh_lock = threading.Lock()
+refreshes_in_flight = set()
+refresh_stats = {
+    "scheduled": 0,
+    "coalesced": 0,
+    "rejected": 0,
+    "completed": 0,
+    "failed": 0,
+    "throttled": 0,
+}
+
+
+refresh_duration = Histogram(
+    "podtube_feed_refresh_duration_seconds",
+    "Duration of update_feed runs, by outcome.",
+    ("outcome",),
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+
+
+def schedule_feed_refresh(feed_id):
+    """Encolar la actualización de un feed si no hay ya una en curso.
+
+    Devuelve False si la petición se une a una actualización pendiente o si
+    la cola está llena. Con JOB_QUEUE_ENABLED se encola en la cola persistente
+    y la ejecuta worker.py.
+    """
+    if JOB_QUEUE_ENABLED:
+        # Las peticiones contadas en este proceso viajan con el trabajo
+        with scheduler_lock:
+            polls = feed_polls.pop(feed_id, 0)
+        if enqueue_job("refresh", feed_id, payload={"polls": polls}):
+            return True
+        with scheduler_lock:
+            feed_polls[feed_id] = feed_polls.get(feed_id, 0) + polls
+        return False
+
+    with refresh_lock:
+        if feed_id in refreshes_in_flight:
+            refresh_stats["coalesced"] += 1
+            return False
+        if len(refreshes_in_flight) >= REFRESH_QUEUE_LIMIT:
+            refresh_stats["rejected"] += 1
+            logger.warning(f"Refresh queue full, skipping feed {feed_id}")
+            return False
+        refreshes_in_flight.add(feed_id)
+        refresh_stats["scheduled"] += 1
+
+    refresh_executor.submit(run_feed_refresh, feed_id)
+    return True
+
+
+def run_feed_refresh(feed_id):
+    """Ejecutar update_feed y liberar el feed al terminar."""
+    outcome = "failed"
+    started = time.perf_counter()
+    lease = f"refresh:{feed_id}"
+    leased = False
+    try:
+        leased = acquire_lease(lease, REFRESH_LEASE_TTL)
+        if not leased:
+            # Otro proceso lo está actualizando
+            outcome = "coalesced"
+            return
+        if update_feed(feed_id):
+            outcome = "completed"
+        elif quota_remaining() <= 0:
+            # Como en refresh_job: sin cuota no es culpa del feed
+            outcome = "throttled"
+            logger.warning(f"Feed {feed_id} not refreshed: daily YouTube API quota exhausted")
+        else:
+            logger.error(f"Error actualizando feed {feed_id}: could not fetch channel or videos")
+    except QuotaExceeded as e:
+        outcome = "throttled"
+        logger.warning(f"Feed {feed_id} not refreshed: {e}")
+    except Exception as e:
+        logger.error(f"Error actualizando feed {feed_id}: {e}")
+    finally:
+        if leased:
+            release_lease(lease)
+        refresh_duration.observe(time.perf_counter() - started, outcome)
+        with refresh_lock:
+            refreshes_in_flight.discard(feed_id)
+            refresh_stats[outcome] += 1
+
+
+# Programador de actualizaciones: cada feed se refresca según la frecuencia con
+# la que sube videos su canal y según cuánto lo piden los clientes
+REFRESH_SCHEDULER_ENABLED = os.getenv("REFRESH_SCHEDULER_ENABLED", "true").lower() == "true"
+REFRESH_MIN_INTERVAL = timedelta(minutes=int(os.getenv("REFRESH_MIN_INTERVAL_MINUTES", 15)))
+REFRESH_MAX_INTERVAL = timedelta(hours=int(os.getenv("REFRESH_MAX_INTERVAL_HOURS", 24)))
+REFRESH_SCHEDULER_TICK = int(os.getenv("REFRESH_SCHEDULER_TICK_SECONDS", 30))
+REFRESH_SCHEDULER_BATCH = int(os.getenv("REFRESH_SCHEDULER_BATCH", 5))
+REFRESH_SCHEDULER_RELOAD = timedelta(minutes=10)
+REFRESH_IDLE_AFTER = timedelta(days=7)
+FULL_SYNC_INTERVAL = timedelta(days=int(os.getenv("FULL_SYNC_INTERVAL_DAYS", 7)))
+REFRESH_BUSY_POLLS = 20
+
+refresh_heap = []  # (fecha, feed_id)
+refresh_due = {}  # feed_id -> fecha vigente; las entradas del heap que no coinciden se ignoran
+feed_polls = {}  # feed_id -> peticiones desde la última actualización
+scheduler_lock = threading.Lock()
+
+
+def record_feed_poll(feed_id):
+    """Contar una petición de un cliente al feed."""
+    with scheduler_lock:
+        feed_polls[feed_id] = feed_polls.get(feed_id, 0) + 1
+
+
+def refresh_due_at(feed):
+    """Fecha en la que toca actualizar el feed."""
+    return feed.next_refresh_at or (feed.last_updated + timedelta(hours=1))
+
+
+def feed_is_stale(feed):
+    """Indicar si el feed debería actualizarse ya."""
+    return datetime.utcnow() >= refresh_due_at(feed)
+
+
+def upload_cadence(videos, sample=10):
+    """Mediana del tiempo entre subidas de los videos más recientes."""
+    dates = []
+    for video in (videos or [])[:sample]:
         try:
-            logger.info(f"Executing command: {' '.join(cmd)}")
-            # Start yt-dlp process
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                bufsize=10**8,  # Large buffer for smooth streaming
+            dates.append(
+                datetime.strptime(video["published_at"], PUB_DATE_FORMAT)
             )
+        except (KeyError, ValueError):
+            continue
 
-            # Stream the output in chunks
-            while True:
-                chunk = process.stdout.read(8192)  # 8KB chunks
-                if not chunk:
-                    break
-                yield chunk
-
-            # Check if there was an error
-            stderr_output = process.stderr.read().decode('utf-8', errors='ignore')
-            if stderr_output:
-                logger.error(f"yt-dlp error for video {video_id}: {stderr_output}")
-                
-        except GeneratorExit:
-            # This exception is raised when the client disconnects
-            logger.info(f"Client disconnected from stream for video {video_id}")
-            if process and process.poll() is None:  # Check if process is still running
-                process.terminate()  # Send SIGTERM
-                try:
-                    process.wait(timeout=5)  # Wait up to 5 seconds for graceful termination
-                except subprocess.TimeoutExpired:
-                    process.kill()  # Force kill if it doesn't terminate gracefully
-                logger.info(f"Terminated yt-dlp process for video {video_id}")
+    dates.sort(reverse=True)
+    gaps = [newer - older for newer, older in zip(dates, dates[1:])]
+    if not gaps:
+        return None
+    return statistics.median(gaps)
+
+
+def compute_refresh_interval(feed, polls):
+    """Calcular cada cuánto debe actualizarse un feed.
+
+    Se parte de una cuarta parte del intervalo típico entre subidas; los feeds
+    sin oyentes recientes se consultan menos y los muy pedidos, más. Se añade
+    un ±10% aleatorio para repartir las llamadas a la API en el tiempo.
+    """
+    cadence = upload_cadence(load_episodes(feed.channel_id, limit=10))
+    interval = cadence / 4 if cadence else REFRESH_MAX_INTERVAL
+
+    now = datetime.utcnow()
+    if polls == 0 and feed.last_polled and now - feed.last_polled > REFRESH_IDLE_AFTER:
+        interval *= 4
+    elif polls >= REFRESH_BUSY_POLLS:
+        interval /= 2
+
+    interval = max(REFRESH_MIN_INTERVAL, min(interval, REFRESH_MAX_INTERVAL))
+    return interval * random.uniform(0.9, 1.1)
+
+
+def push_refresh(feed_id, due):
+    """Poner (o mover) un feed en la cola de prioridad del programador."""
+    with scheduler_lock:
+        refresh_due[feed_id] = due
+        heapq.heappush(refresh_heap, (due, feed_id))
+
+
+def plan_next_refresh(feed, polls=0):
+    """Programar la próxima actualización de un feed recién escrito."""
+    with scheduler_lock:
+        polls += feed_polls.pop(feed.id, 0)
+    if polls:
+        feed.last_polled = datetime.utcnow()
+
+    feed.next_refresh_at = datetime.utcnow() + compute_refresh_interval(feed, polls)
+    push_refresh(feed.id, feed.next_refresh_at)
+
+
+def load_refresh_schedule():
+    """Reconstruir la cola de prioridad a partir de la base de datos."""
+    feeds = db.session.query(
+        PodcastFeed.id, PodcastFeed.next_refresh_at, PodcastFeed.last_updated
+    ).all()
+    with scheduler_lock:
+        refresh_heap.clear()
+        refresh_due.clear()
+        for feed_id, next_refresh_at, last_updated in feeds:
+            due = next_refresh_at or (last_updated or datetime.utcnow())
+            refresh_due[feed_id] = due
+            refresh_heap.append((due, feed_id))
+        heapq.heapify(refresh_heap)
+    logger.info(f"Refresh scheduler loaded {len(feeds)} feeds")
+
+
+def pop_due_refreshes(now, limit):
+    """Sacar de la cola hasta ``limit`` feeds cuya actualización ya toca."""
+    due_feeds = []
+    with scheduler_lock:
+        while refresh_heap and len(due_feeds) < limit:
+            due, feed_id = refresh_heap[0]
+            if due > now:
+                break
+            heapq.heappop(refresh_heap)
+            if refresh_due.get(feed_id) != due:
+                continue  # Entrada reemplazada por una más reciente
+            due_feeds.append(feed_id)
+            # Reintento por si la actualización falla; update_feed la reemplaza
+            retry = now + REFRESH_MAX_INTERVAL
+            refresh_due[feed_id] = retry
+            heapq.heappush(refresh_heap, (retry, feed_id))
+    return due_feeds
+
+
+def refresh_scheduler_loop():
+    """Lanzar las actualizaciones programadas poco a poco."""
+    last_reload = None
+    while True:
+        try:
+            now = datetime.utcnow()
+            if last_reload is None or now - last_reload > REFRESH_SCHEDULER_RELOAD:
+                with app.app_context():
+                    load_refresh_schedule()
+                last_reload = now
+
+            # Como mucho REFRESH_SCHEDULER_BATCH feeds por ciclo para no
+            # concentrar el consumo de cuota; sin cuota se espera al reinicio
+            with app.app_context():
+                batch = REFRESH_SCHEDULER_BATCH if quota_remaining() > 0 else 0
+            for feed_id in pop_due_refreshes(now, batch):
+                schedule_feed_refresh(feed_id)
         except Exception as e:
-            logger.error(f"Error streaming audio for video {video_id}: {e}")
-            if process and process.poll() is None:
-                process.terminate()
-            yield b""
+            logger.error(f"Error en el programador de actualizaciones: {e}")
+
+        time.sleep(REFRESH_SCHEDULER_TICK)
+
+
+def start_refresh_scheduler():
+    thread = threading.Thread(
+        target=refresh_scheduler_loop, name="refresh-scheduler", daemon=True
+    )
+    thread.start()
+    return thread
+
+
+# Sesión HTTP para pedir el audio directamente a los servidores de YouTube
+media_session = create_api_session()
+MEDIA_RESOLVE_TIMEOUT = int(os.getenv("MEDIA_RESOLVE_TIMEOUT", 60))
+
+# Las URLs directas que devuelve yt-dlp caducan (parámetro ``expire``); se
+# guardan hasta entonces para no repetir la extracción en cada reproducción
+MEDIA_URL_TTL = timedelta(hours=int(os.getenv("MEDIA_URL_TTL_HOURS", 4)))
+MEDIA_URL_EXPIRY_MARGIN = timedelta(minutes=10)
+MEDIA_URL_CACHE_SIZE = 1000
+# YouTube limita la velocidad de las peticiones sin rango; se descarga por bloques
+MEDIA_CHUNK_SIZE = 10 * 1024 * 1024
+
+media_url_cache = {}  # video_id -> resultado de resolve_media
+media_cache_lock = threading.Lock()
+media_resolve_locks = [threading.Lock() for _ in range(64)]
+media_url_stats = {"hits": 0, "resolves": 0, "failures": 0, "expired": 0}
+
+
+def resolve_media(video_id):
+    """Resolver con yt-dlp la URL directa del mejor audio de un video.
+
+    Devuelve un diccionario con la URL, las cabeceras HTTP que exige YouTube,
+    el tamaño si se conoce, el título y la duración, o None si la extracción
+    falla.
+    """
+    try:
+        info = extractor_pool.submit(
+            "extract",
+            f"https://www.youtube.com/watch?v={video_id}",
+            {"format": "bestaudio", "noplaylist": True},
+            timeout=MEDIA_RESOLVE_TIMEOUT,
+        )
+        return {
+            "url": info["url"],
+            "headers": info.get("http_headers", {}),
+            "filesize": info.get("filesize") or info.get("filesize_approx"),
+            "title": info.get("title"),
+            "duration": info.get("duration") or 0,
+        }
+    except Exception as e:
+        logger.error(f"Error resolviendo audio de {video_id}: {e}")
+        return None
+
+
+def media_url_expiry(url):
+    """Fecha hasta la que se puede reutilizar una URL directa de YouTube."""
+    expires_at = datetime.utcnow() + MEDIA_URL_TTL
+    match = re.search(r"[?&/]expire[=/](\d+)", url)
+    if match:
+        url_expiry = datetime.utcfromtimestamp(int(match.group(1))) - MEDIA_URL_EXPIRY_MARGIN
+        expires_at = min(expires_at, url_expiry)
+    return expires_at
+
+
+def get_media(video_id, refresh=False):
+    """Devolver la URL directa del audio, resolviéndola solo si no está en caché.
+
+    Con ``refresh`` se descarta la entrada guardada (por ejemplo, si YouTube
+    la ha rechazado). Las resoluciones del mismo video se serializan para que
+    varias peticiones simultáneas lancen un solo yt-dlp.
+    """
+    with media_cache_lock:
+        stale = media_url_cache.get(video_id)
+        if stale and not refresh and stale["expires_at"] > datetime.utcnow():
+            media_url_stats["hits"] += 1
+            return stale
+
+    with media_resolve_locks[hash(video_id) % len(media_resolve_locks)]:
+        with media_cache_lock:
+            current = media_url_cache.get(video_id)
+            if current and current is not stale and current["expires_at"] > datetime.utcnow():
+                media_url_stats["hits"] += 1
+                return current
+
+        media = resolve_media(video_id)
+        with media_cache_lock:
+            if not media:
+                media_url_stats["failures"] += 1
+                media_url_cache.pop(video_id, None)
+                return None
+
+            media_url_stats["resolves"] += 1
+            media["expires_at"] = media_url_expiry(media["url"])
+            if len(media_url_cache) >= MEDIA_URL_CACHE_SIZE:
+                now = datetime.utcnow()
+                for cached_id in [
+                    key for key, entry in media_url_cache.items() if entry["expires_at"] <= now
+                ]:
+                    del media_url_cache[cached_id]
+            media_url_cache[video_id] = media
+        return media
+
+
+def open_media(video_id, range_header=None):
+    """Abrir una petición al audio de YouTube, pasando el rango pedido.
+
+    Si YouTube rechaza la URL guardada (403/410) se resuelve de nuevo una
+    vez. Devuelve ``(media, respuesta)``, o ``(None, None)`` si no se pudo
+    resolver.
+    """
+    media = get_media(video_id)
+    for attempt in range(2):
+        if not media:
+            return None, None
+
+        headers = dict(media["headers"])
+        if range_header:
+            headers["Range"] = range_header
+        upstream = media_session.get(
+            media["url"],
+            headers=headers,
+            stream=True,
+            timeout=(YOUTUBE_API_CONNECT_TIMEOUT, YOUTUBE_API_READ_TIMEOUT),
+        )
+        if upstream.status_code in (403, 410) and attempt == 0:
+            upstream.close()
+            with media_cache_lock:
+                media_url_stats["expired"] += 1
+            media = get_media(video_id, refresh=True)
+            continue
+        return media, upstream
+
+
+def proxy_media_range(video_id, range_header):
+    """Servir un rango de bytes del audio pidiéndolo directamente a YouTube."""
+    media, upstream = open_media(video_id, range_header)
+    if not media:
+        return jsonify({"error": "Could not resolve audio stream"}), 502
+
+    if upstream.status_code == 416:
+        upstream.close()
+        response = Response(status=416)
+        if media["filesize"]:
+            response.headers["Content-Range"] = f"bytes */{media['filesize']}"
+        return response
+    if upstream.status_code not in (200, 206):
+        upstream.close()
+        logger.error(f"Upstream returned {upstream.status_code} for video {video_id}")
+        return jsonify({"error": "Upstream error"}), 502
+
+    def generate():
+        try:
+            for chunk in upstream.iter_content(8192):
+                yield chunk
         finally:
-            # Ensure process is terminated when the generator is garbage collected
-            if process and process.poll() is None:
-                process.terminate()
-                try:
-                    process.wait(timeout=5)
-                except subprocess.TimeoutExpired:
-                    process.kill()
+            upstream.close()
+
+    response_headers = {"Accept-Ranges": "bytes", "Cache-Control": "no-cache"}
+    for header in ("Content-Range", "Content-Length"):
+        if header in upstream.headers:
+            response_headers[header] = upstream.headers[header]
+
+    return Response(
+        stream_with_context(metered_stream(generate())),
+        status=upstream.status_code,
+        mimetype="audio/mpeg",
+        headers=response_headers,
+    )
+
+
+def stream_cache_path(video_id):
+    """Ruta del stream guardado en caché por stream_audio.
+
+    En modo CBR es el MP3 de bitrate constante; si no, el stream original
+    sin transcodificar.
+    """
+    if AUDIO_CBR_KBPS:
+        return os.path.join(AUDIO_CACHE_DIR, f"{video_id}.cbr{AUDIO_CBR_KBPS}.mp3")
+    return os.path.join(AUDIO_CACHE_DIR, f"{video_id}.stream")
+
+
+def cached_audio_path(video_id):
+    """Ruta del audio cacheado de un video, o None si no está en disco.
+
+    Se prefiere el MP3 de download_audio y, si no existe, el stream guardado
+    por stream_audio. En modo CBR solo vale el MP3 CBR, cuyo tamaño coincide
+    con el anunciado en el feed.
+    """
+    if AUDIO_CBR_KBPS:
+        path = stream_cache_path(video_id)
+        return path if os.path.exists(path) else None
+
+    for path in (
+        os.path.join(AUDIO_CACHE_DIR, f"{video_id}.mp3"),
+        stream_cache_path(video_id),
+    ):
+        if os.path.exists(path):
+            return path
+    return None
+
 
+def open_cbr_transcoder(video_id, start_byte=0):
+    """Lanzar ffmpeg para transcodificar el audio a MP3 CBR desde un byte dado.
+
+    El byte se convierte en un instante (``start_byte / CBR_BYTES_PER_SECOND``)
+    y ffmpeg empieza a leer desde ahí, así que un rango a mitad del episodio
+    no obliga a transcodificar desde el principio. Devuelve ``(media, proceso)``
+    o ``(None, None)`` si no se pudo resolver el audio.
+    """
+    media = get_media(video_id)
+    if not media:
+        return None, None
+
+    process = subprocess.Popen(
+        cbr_transcoder_command(media, start_byte),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    with stream_lock:
+        stream_stats["transcoders"] += 1
+    return media, process
+
+
+def cbr_transcoder_command(media, start_byte=0):
+    """Línea de comandos de ffmpeg para transcodificar a CBR desde ``start_byte``."""
+    headers = "".join(f"{key}: {value}\r\n" for key, value in media["headers"].items())
+    return [
+        "ffmpeg",
+        "-nostdin",
+        "-loglevel",
+        "error",
+        "-headers",
+        headers,
+        "-ss",
+        f"{start_byte / CBR_BYTES_PER_SECOND:.3f}",
+        "-i",
+        media["url"],
+        "-vn",
+        "-map_metadata",
+        "-1",
+        "-id3v2_version",
+        "0",
+        "-write_xing",
+        "0",
+        "-codec:a",
+        "libmp3lame",
+        "-b:a",
+        f"{AUDIO_CBR_KBPS}k",
+        "-f",
+        "mp3",
+        "-",
+    ]
+
+
+def read_exact(process, length, chunk_size=8192):
+    """Leer exactamente ``length`` bytes de ffmpeg, rellenando con ceros.
+
+    El codificador no produce justo la longitud teórica; recortar o rellenar
+    el final mantiene el tamaño anunciado sin afectar a la reproducción.
+    """
+    try:
+        remaining = length
+        while remaining > 0:
+            chunk = process.stdout.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+        while remaining > 0:
+            padding = min(chunk_size, remaining)
+            remaining -= padding
+            yield bytes(padding)
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        with stream_lock:
+            stream_stats["transcoders"] -= 1
+
+
+def cbr_range_response(video_id):
+    """Servir un rango del audio CBR transcodificando desde su posición."""
+    media = get_media(video_id)
+    total = media and cbr_feed_length(video_id, media)
+    if not total:
+        return jsonify({"error": "Could not resolve audio stream"}), 502
+
+    byte_range = request.range.range_for_length(total)
+    if not byte_range:
+        return Response(status=416, headers={"Content-Range": f"bytes */{total}"})
+
+    start, stop = byte_range
+    _, process = open_cbr_transcoder(video_id, start)
     return Response(
-        stream_with_context(generate()),  # Use stream_with_context to properly handle client disconnection
+        stream_with_context(metered_stream(read_exact(process, stop - start))),
+        status=206,
         mimetype="audio/mpeg",
         headers={
             "Accept-Ranges": "bytes",
             "Cache-Control": "no-cache",
-            "Transfer-Encoding": "chunked",
+            "Content-Range": f"bytes {start}-{stop - 1}/{total}",
+            "Content-Length": str(stop - start),
         },
     )
 
 
+class StreamFill:
+    """Volcado al caché del audio de un video, compartido entre oyentes.
+
+    El primer oyente lanza la descarga en un hilo; todos los oyentes leen del
+    mismo fichero mientras crece. Al terminar, el fichero pasa a ser el audio
+    cacheado del video y se registra en CachedVideo.
+    """
+
+    def __init__(self, video_id):
+        self.video_id = video_id
+        self.path = stream_cache_path(video_id)
+        self.part_path = f"{self.path}.part"
+        self.file = open(self.part_path, "wb")
+        self.written = 0
+        self.total = None  # Tamaño final, en cuanto se conoce
+        self.done = False
+        self.condition = threading.Condition()
+        self.lease = fill_lease(video_id)
+        self.renew_at = time.monotonic() + FILL_LEASE_TTL.total_seconds() / 3
+
+    def append(self, chunk):
+        self.file.write(chunk)
+        self.file.flush()
+        with self.condition:
+            self.written += len(chunk)
+            self.condition.notify_all()
+
+        if time.monotonic() >= self.renew_at:
+            renew_lease(self.lease, FILL_LEASE_TTL)
+            self.renew_at = time.monotonic() + FILL_LEASE_TTL.total_seconds() / 3
+
+    def fill_from_media(self):
+        """Descargar el audio original por bloques de MEDIA_CHUNK_SIZE."""
+        media = None
+        while True:
+            end = self.written + MEDIA_CHUNK_SIZE - 1
+            media, upstream = open_media(self.video_id, f"bytes={self.written}-{end}")
+            if not media:
+                raise RuntimeError("could not resolve audio stream")
+
+            with upstream:
+                if upstream.status_code == 416:
+                    break
+                if upstream.status_code not in (200, 206):
+                    raise RuntimeError(f"upstream returned {upstream.status_code}")
+
+                total = upstream.headers.get("Content-Range", "").rpartition("/")[2]
+                if upstream.status_code == 200:
+                    total = upstream.headers.get("Content-Length", "")
+                if total.isdigit() and self.total is None:
+                    self.set_total(int(total))
+
+                received = 0
+                for chunk in upstream.iter_content(8192):
+                    self.append(chunk)
+                    received += len(chunk)
+
+                if upstream.status_code == 200 or received < MEDIA_CHUNK_SIZE:
+                    break
+                if self.total is not None and self.written >= self.total:
+                    break
+        return media
+
+    def fill_from_transcoder(self):
+        """Transcodificar a MP3 CBR con el tamaño exacto que anuncia el feed."""
+        media, process = open_cbr_transcoder(self.video_id)
+        if not media:
+            raise RuntimeError("could not resolve audio stream")
+
+        self.set_total(cbr_feed_length(self.video_id, media))
+        for chunk in read_exact(process, self.total):
+            self.append(chunk)
+
+        # read_exact mata a ffmpeg al completar el tamaño; otro código de
+        # salida indica que la transcodificación falló
+        if process.returncode not in (0, -signal.SIGKILL):
+            raise RuntimeError(f"ffmpeg exited with code {process.returncode}")
+        return media
+
+    def run(self):
+        try:
+            if AUDIO_CBR_KBPS:
+                media = self.fill_from_transcoder()
+            else:
+                media = self.fill_from_media()
+
+            if not self.written:
+                raise RuntimeError("empty audio stream")
+
+            self.file.close()
+            os.replace(self.part_path, self.path)
+            self.save_cached_video(media)
+            logger.info(f"Cached stream for video {self.video_id} ({self.written} bytes)")
+        except Exception as e:
+            logger.error(f"Error streaming audio for video {self.video_id}: {e}")
+            if os.path.exists(self.part_path):
+                os.remove(self.part_path)
+        finally:
+            self.file.close()
+            release_lease(self.lease)
+            with stream_fills_lock:
+                stream_fills.pop(self.video_id, None)
+            with self.condition:
+                self.done = True
+                self.condition.notify_all()
+
+    def wait(self):
+        """Esperar a que termine el volcado."""
+        with self.condition:
+            while not self.done:
+                self.condition.wait()
+
+    def set_total(self, total):
+        with self.condition:
+            self.total = total
+            self.condition.notify_all()
+
+    def length(self, timeout):
+        """Esperar como mucho ``timeout`` segundos a conocer el tamaño final."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.total is not None or self.done, timeout)
+            return self.total if not self.done or self.written == self.total else None
+
+    def save_cached_video(self, media):
+        """Registrar el stream descargado en CachedVideo."""
+        with app.app_context():
+            video = db.session.get(CachedVideo, self.video_id)
+            if not video:
+                video = CachedVideo(id=self.video_id, title=media.get("title") or self.video_id)
+            video.audio_path = self.path
+            video.file_size = self.written
+            video.duration = format_duration(media.get("duration") or 0)
+            video.last_accessed = datetime.utcnow()
+            db.session.add(video)
+            db.session.commit()
+
+    def read(self, start=0, stop=None, chunk_size=8192):
+        """Leer el fichero desde ``start`` hasta ``stop``, esperando a los bytes que faltan."""
+        try:
+            part_file = open(self.part_path, "rb")
+        except FileNotFoundError:
+            # El volcado acaba de terminar (o de fallar)
+            if not os.path.exists(self.path):
+                return
+            part_file = open(self.path, "rb")
+
+        with part_file:
+            part_file.seek(start)
+            position = start
+            while stop is None or position < stop:
+                size = chunk_size if stop is None else min(chunk_size, stop - position)
+                chunk = part_file.read(size)
+                if chunk:
+                    position += len(chunk)
+                    yield chunk
+                    continue
+
+                with self.condition:
+                    while not self.done and self.written <= position:
+                        self.condition.wait(timeout=1)
+                    if self.done and self.written <= position:
+                        return
+
+
+class ForeignStreamFill:
+    """Volcado que está haciendo otro proceso: se sigue su fichero en disco.
+
+    Tiene la misma interfaz de lectura que StreamFill. Termina cuando el
+    fichero parcial desaparece (el volcado acabó o falló) o cuando caduca el
+    lease de su dueño (el proceso murió). Si quien tiene el lease es
+    download_audio no hay fichero que seguir (ver ``readable``).
+    """
+
+    def __init__(self, video_id):
+        self.video_id = video_id
+        self.path = stream_cache_path(video_id)
+        self.part_path = f"{self.path}.part"
+        self.lease = fill_lease(video_id)
+        self.checked_at = time.monotonic()
+        self.owner_alive = True
+
+    @property
+    def done(self):
+        if not os.path.exists(self.part_path):
+            return True
+        if time.monotonic() - self.checked_at > LEASE_CHECK_INTERVAL:
+            self.checked_at = time.monotonic()
+            self.owner_alive = lease_held(self.lease)
+        return not self.owner_alive
+
+    @property
+    def readable(self):
+        return os.path.exists(self.part_path) or os.path.exists(self.path)
+
+    @property
+    def written(self):
+        for path in (self.part_path, self.path):
+            try:
+                return os.path.getsize(path)
+            except FileNotFoundError:
+                continue
+        return 0
+
+    def read(self, start=0, stop=None, chunk_size=8192):
+        """Leer el fichero desde ``start`` hasta ``stop``, esperando a los bytes que faltan."""
+        try:
+            part_file = open(self.part_path, "rb")
+        except FileNotFoundError:
+            if not os.path.exists(self.path):
+                return
+            part_file = open(self.path, "rb")
+
+        with part_file:
+            part_file.seek(start)
+            position = start
+            while stop is None or position < stop:
+                size = chunk_size if stop is None else min(chunk_size, stop - position)
+                chunk = part_file.read(size)
+                if chunk:
+                    position += len(chunk)
+                    yield chunk
+                    continue
+                if self.done and self.written <= position:
+                    return
+                time.sleep(0.25)
+
+    def wait(self):
+        while not self.done:
+            time.sleep(1)
+
+    def length(self, timeout):
+        # El tamaño final solo lo conoce el proceso que hace el volcado
+        return None
+
+
+stream_fills = {}  # video_id -> StreamFill en curso
+stream_fills_lock = threading.Lock()
+
+
+def fill_covers(video_id, start):
+    """Si un rango que empieza en ``start`` debe servirse desde el volcado al caché.
+
+    Desde el principio siempre (así empiezan los reproductores, con
+    ``bytes=0-``); a mitad de fichero solo si un volcado en curso ya ha
+    escrito ese byte. El resto son saltos y se piden directamente a YouTube.
+    """
+    if start == 0:
+        return True
+    with stream_fills_lock:
+        fill = stream_fills.get(video_id)
+    if fill:
+        return start <= fill.written
+    # Volcado de otro proceso
+    try:
+        return start <= os.path.getsize(f"{stream_cache_path(video_id)}.part")
+    except FileNotFoundError:
+        return False
+
+
+def join_stream_fill(video_id):
+    """Devolver el volcado en curso del video, o lanzar uno nuevo.
+
+    Devuelve None si el audio ya está completo en el caché, y un
+    ForeignStreamFill si otro proceso (o download_audio) ya lo está llenando.
+    """
+    with stream_fills_lock:
+        fill = stream_fills.get(video_id)
+        if fill:
+            return fill
+        if cached_audio_path(video_id):
+            return None
+        if not acquire_lease(fill_lease(video_id), FILL_LEASE_TTL):
+            return ForeignStreamFill(video_id)
+
+        fill = StreamFill(video_id)
+        stream_fills[video_id] = fill
+
+    thread = threading.Thread(
+        target=fill.run, name=f"stream-fill-{video_id}", daemon=True
+    )
+    thread.start()
+    return fill
+
+
+# Descarga anticipada de los episodios más nuevos de cada feed. Cada trabajo
+# lanza un proceso yt-dlp, así que el número de hilos limita los procesos
+# simultáneos; el ancho de banda total se reparte entre ellos.
+PREFETCH_EPISODES = int(os.getenv("PREFETCH_EPISODES", 2))
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", 2))
+PREFETCH_QUEUE_LIMIT = int(os.getenv("PREFETCH_QUEUE_LIMIT", 50))
+PREFETCH_MAX_BANDWIDTH = int(os.getenv("PREFETCH_MAX_BANDWIDTH", 0))  # bytes/s, 0 = sin límite
+
+prefetch_executor = ThreadPoolExecutor(
+    max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch"
+)
+prefetch_lock = threading.Lock()
+prefetches_pending = set()
+prefetch_stats = {"queued": 0, "skipped": 0, "rejected": 0, "completed": 0, "failed": 0}
+
+
+def prefetch_episodes(videos):
+    """Encolar la descarga de los PREFETCH_EPISODES videos más recientes."""
+    for index, video in enumerate((videos or [])[:PREFETCH_EPISODES]):
+        video_id = video["id"]
+        if JOB_QUEUE_ENABLED:
+            # Los más nuevos primero, siempre detrás de las actualizaciones
+            if not cached_audio_path(video_id):
+                enqueue_job("download", video_id, priority=-index)
+            continue
+
+        with prefetch_lock:
+            if (
+                video_id in prefetches_pending
+                or video_id in stream_fills
+                or cached_audio_path(video_id)
+            ):
+                prefetch_stats["skipped"] += 1
+                continue
+            if len(prefetches_pending) >= PREFETCH_QUEUE_LIMIT:
+                prefetch_stats["rejected"] += 1
+                continue
+            prefetches_pending.add(video_id)
+            prefetch_stats["queued"] += 1
+
+        prefetch_executor.submit(run_prefetch, video_id)
+
+
+def cache_episode_audio(video_id, rate_limit=None):
+    """Llevar el audio de un episodio al caché.
+
+    Devuelve "skipped" si ya estaba (o se está volcando), "completed" si se
+    ha cacheado y "failed" si no.
+    """
+    # Puede haberse cacheado mientras esperaba en la cola
+    if cached_audio_path(video_id) or video_id in stream_fills:
+        return "skipped"
+    if AUDIO_CBR_KBPS:
+        # En modo CBR el caché lo llena el mismo volcado que stream_audio
+        fill = join_stream_fill(video_id)
+        if fill:
+            fill.wait()
+    else:
+        with app.app_context():
+            download_audio(video_id, rate_limit=rate_limit)
+    return "completed" if cached_audio_path(video_id) else "failed"
+
+
+def run_prefetch(video_id):
+    """Descargar un episodio al caché de audio."""
+    rate_limit = PREFETCH_MAX_BANDWIDTH // PREFETCH_WORKERS or None
+    outcome = "failed"
+    try:
+        outcome = cache_episode_audio(video_id, rate_limit)
+    except Exception as e:
+        logger.error(f"Error descargando por adelantado {video_id}: {e}")
+    finally:
+        with prefetch_lock:
+            prefetches_pending.discard(video_id)
+            prefetch_stats[outcome] += 1
+
+
+# Cola persistente de trabajos. Con JOB_QUEUE_ENABLED la web solo encola las
+# actualizaciones y descargas, y las ejecuta el proceso worker.py; los trabajos
+# sobreviven a reinicios, se reintentan con backoff exponencial y, agotados
+# los intentos, quedan como "dead" para revisarlos en /api/jobs.
+JOB_QUEUE_ENABLED = os.getenv("JOB_QUEUE_ENABLED", "false").lower() == "true"
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+JOB_BACKOFF_BASE = int(os.getenv("JOB_BACKOFF_BASE_SECONDS", 30))
+JOB_BACKOFF_MAX = int(os.getenv("JOB_BACKOFF_MAX_SECONDS", 3600))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", 1))
+JOB_RETENTION = timedelta(days=int(os.getenv("JOB_RETENTION_DAYS", 7)))
+JOB_PRIORITIES = {"refresh": 10, "download": 0}
+job_lock = threading.Lock()
+job_stats = {"enqueued": 0, "deduplicated": 0, "completed": 0, "retried": 0, "throttled": 0, "dead": 0}
+# Tiempo máximo de un trabajo; después se da por muerto su proceso
+JOB_TIMEOUTS = {
+    "refresh": REFRESH_LEASE_TTL,
+    "download": timedelta(seconds=DOWNLOAD_TIMEOUT + 60),
+}
+
+
+def enqueue_job(kind, target, priority=None, payload=None):
+    """Encolar un trabajo si no hay ya uno pendiente o en curso para ``target``.
+
+    Devuelve True si se ha creado. Si ya había uno pendiente se le sube la
+    prioridad cuando la nueva es mayor.
+    """
+    dedup_key = f"{kind}:{target}"
+    if priority is None:
+        priority = JOB_PRIORITIES[kind]
+    statement = sqlite_insert(Job).values(
+        kind=kind,
+        target=target,
+        payload=payload,
+        dedup_key=dedup_key,
+        priority=priority,
+        status="queued",
+        attempts=0,
+        max_attempts=JOB_MAX_ATTEMPTS,
+        run_after=datetime.utcnow(),
+        created_at=datetime.utcnow(),
+    ).prefix_with("OR IGNORE")
+
+    with app.app_context(), db.engine.begin() as connection:
+        created = connection.execute(statement).rowcount == 1
+        if not created:
+            # Hay uno pendiente o en curso: subirle la prioridad si es necesario
+            connection.execute(
+                db.update(Job)
+                .where(Job.dedup_key == dedup_key, Job.status == "queued")
+                .values(priority=db.func.max(Job.priority, priority))
+            )
+    with job_lock:
+        job_stats["enqueued" if created else "deduplicated"] += 1
+    return created
+
+
+def claim_job():
+    """Tomar el siguiente trabajo listo (mayor prioridad primero) o None."""
+    now = datetime.utcnow()
+    with app.app_context(), db.engine.begin() as connection:
+        # Esta escritura va primero para tomar el lock de escritura de SQLite
+        # antes de elegir trabajo; así dos procesos no eligen el mismo.
+        # Además recupera los trabajos de procesos que murieron.
+        connection.execute(
+            db.update(Job)
+            .where(Job.status == "running", Job.lock_expires_at < now)
+            .values(status="queued", locked_by=None)
+        )
+        job = connection.execute(
+            db.select(Job.id, Job.kind, Job.target, Job.payload, Job.attempts)
+            .where(Job.status == "queued", Job.run_after <= now)
+            .order_by(Job.priority.desc(), Job.run_after, Job.id)
+            .limit(1)
+        ).first()
+        if not job:
+            return None
+        connection.execute(
+            db.update(Job)
+            .where(Job.id == job.id)
+            .values(
+                status="running",
+                attempts=Job.attempts + 1,
+                started_at=now,
+                locked_by=LEASE_OWNER,
+                lock_expires_at=now + JOB_TIMEOUTS[job.kind],
+            )
+        )
+    return job
+
+
+def finish_job(job, error=None, retry_at=None):
+    """Marcar un trabajo como hecho, o programar su reintento o darlo por muerto.
+
+    Con ``retry_at`` el trabajo vuelve a la cola para esa fecha sin gastar un
+    intento (por ejemplo, si se agotó la cuota).
+    """
+    now = datetime.utcnow()
+    values = {"finished_at": now, "locked_by": None, "lock_expires_at": None}
+    if error is None:
+        values["status"] = "done"
+        outcome = "completed"
+    elif retry_at:
+        values.update(status="queued", run_after=retry_at, attempts=job.attempts, last_error=error[:2000])
+        outcome = "throttled"
+        logger.warning(f"Job {job.kind}:{job.target} postponed until {retry_at}: {error}")
+    else:
+        attempts = job.attempts + 1
+        values["last_error"] = error[:2000]
+        with app.app_context(), db.engine.connect() as connection:
+            max_attempts = connection.execute(
+                db.select(Job.max_attempts).where(Job.id == job.id)
+            ).scalar()
+        if attempts >= max_attempts:
+            values["status"] = outcome = "dead"
+            logger.error(f"Job {job.kind}:{job.target} failed {attempts} times, giving up: {error}")
+        else:
+            delay = min(JOB_BACKOFF_BASE * 2 ** (attempts - 1), JOB_BACKOFF_MAX)
+            values["status"] = "queued"
+            outcome = "retried"
+            values["run_after"] = now + timedelta(seconds=delay * random.uniform(0.9, 1.1))
+            logger.warning(f"Job {job.kind}:{job.target} failed, retrying in {delay}s: {error}")
+
+    with app.app_context(), db.engine.begin() as connection:
+        connection.execute(db.update(Job).where(Job.id == job.id).values(**values))
+    with job_lock:
+        job_stats[outcome] += 1
+
+
+def job_queue_depth():
+    """Trabajos por tipo y estado, y antigüedad en segundos del más viejo pendiente."""
+    now = datetime.utcnow()
+    queues = {}
+    counts = (
+        db.session.query(Job.kind, Job.status, db.func.count(Job.id), db.func.min(Job.created_at))
+        .filter(Job.status != "done")
+        .group_by(Job.kind, Job.status)
+        .all()
+    )
+    for kind, status, count, oldest in counts:
+        queue = queues.setdefault(kind, {"queued": 0, "running": 0, "dead": 0, "oldest_queued_seconds": 0})
+        queue[status] = count
+        if status == "queued":
+            queue["oldest_queued_seconds"] = int((now - oldest).total_seconds())
+    return queues
+
+
+def purge_jobs():
+    """Borrar los trabajos terminados hace más de JOB_RETENTION."""
+    with app.app_context(), db.engine.begin() as connection:
+        result = connection.execute(
+            db.delete(Job).where(
+                Job.status == "done", Job.finished_at < datetime.utcnow() - JOB_RETENTION
+            )
+        )
+    return result.rowcount
+
+
+def refresh_job(feed_id, payload):
+    lease = f"refresh:{feed_id}"
+    if not acquire_lease(lease, REFRESH_LEASE_TTL):
+        return  # Lo está actualizando otro proceso
+    try:
+        if not update_feed(feed_id, polls=(payload or {}).get("polls", 0)):
+            # update_feed no distingue por qué falló; sin cuota no es culpa del feed
+            if quota_remaining() <= 0:
+                raise QuotaExceeded("daily YouTube API quota exhausted")
+            raise RuntimeError("could not fetch channel or videos")
+    finally:
+        release_lease(lease)
+
+
+def download_job(video_id, payload):
+    rate_limit = PREFETCH_MAX_BANDWIDTH // PREFETCH_WORKERS or None
+    if cache_episode_audio(video_id, rate_limit) == "failed":
+        raise RuntimeError("audio was not cached")
+
+
+JOB_HANDLERS = {"refresh": refresh_job, "download": download_job}
+
+
+def run_job_worker(stop):
+    """Ejecutar trabajos de la cola hasta que se active ``stop``."""
+    while not stop.is_set():
+        try:
+            job = claim_job()
+        except Exception as e:
+            logger.error(f"Error tomando trabajos de la cola: {e}")
+            job = None
+        if not job:
+            stop.wait(JOB_POLL_INTERVAL)
+            continue
+
+        try:
+            JOB_HANDLERS[job.kind](job.target, job.payload)
+            finish_job(job)
+        except QuotaExceeded as e:
+            finish_job(job, f"QuotaExceeded: {e}", retry_at=quota_reset_at())
+        except Exception as e:
+            finish_job(job, f"{type(e).__name__}: {e}")
+
+
+# Límite de tamaño del caché de audio: cuando se supera AUDIO_CACHE_MAX_BYTES se
+# borran los audios usados hace más tiempo hasta bajar a la marca inferior
+AUDIO_CACHE_EVICTOR_ENABLED = os.getenv("AUDIO_CACHE_EVICTOR_ENABLED", "true").lower() == "true"
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_BYTES", 10 * 1024 ** 3))
+AUDIO_CACHE_LOW_WATER = float(os.getenv("AUDIO_CACHE_LOW_WATER", 0.8))
+AUDIO_CACHE_EVICT_INTERVAL = int(os.getenv("AUDIO_CACHE_EVICT_INTERVAL_SECONDS", 300))
+AUDIO_CACHE_ORPHAN_GRACE = timedelta(hours=1)
+
+audio_cache_lock = threading.Lock()
+audio_touches = {}  # video_id -> último acceso pendiente de guardar
+audio_cache_stats = {
+    "hits": 0,
+    "misses": 0,
+    "evictions": 0,
+    "evicted_bytes": 0,
+    "orphan_files": 0,
+    "orphan_rows": 0,
+}
+
+
+# Los accesos se guardan en una transacción cada ACCESS_FLUSH_INTERVAL
+# segundos, o antes si se acumulan ACCESS_FLUSH_BATCH
+ACCESS_FLUSH_INTERVAL = int(os.getenv("ACCESS_FLUSH_INTERVAL_SECONDS", 5))
+ACCESS_FLUSH_BATCH = int(os.getenv("ACCESS_FLUSH_BATCH", 200))
+access_flush_wanted = threading.Event()
+
+
+def touch_cached_video(video_id):
+    """Anotar un acceso a CachedVideo para guardarlo en el próximo lote."""
+    with audio_cache_lock:
+        audio_touches[video_id] = datetime.utcnow()
+        pending = len(audio_touches)
+    if pending >= ACCESS_FLUSH_BATCH:
+        access_flush_wanted.set()
+
+
+def record_audio_access(video_id, hit):
+    """Contar un acierto o fallo del caché y anotar el acceso para el LRU."""
+    with audio_cache_lock:
+        audio_cache_stats["hits" if hit else "misses"] += 1
+    if hit:
+        touch_cached_video(video_id)
+
+
+def flush_audio_touches():
+    """Guardar en una sola transacción los accesos anotados."""
+    with audio_cache_lock:
+        touches = dict(audio_touches)
+        audio_touches.clear()
+    if not touches:
+        return
+
+    # Videos que ya no existen no hacen nada: UPDATE ... WHERE id = ?
+    db.session.execute(
+        db.update(CachedVideo.__table__)
+        .where(CachedVideo.__table__.c.id == db.bindparam("video_id"))
+        .values(last_accessed=db.bindparam("accessed")),
+        [{"video_id": video_id, "accessed": accessed} for video_id, accessed in touches.items()],
+    )
+    db.session.commit()
+
+
+def access_flusher_loop():
+    """Guardar los accesos anotados periódicamente o al llenarse el lote."""
+    while True:
+        access_flush_wanted.wait(ACCESS_FLUSH_INTERVAL)
+        access_flush_wanted.clear()
+        try:
+            with app.app_context():
+                flush_audio_touches()
+        except Exception as e:
+            logger.error(f"Error guardando los accesos a videos: {e}")
+
+
+def start_access_flusher():
+    thread = threading.Thread(
+        target=access_flusher_loop, name="access-flusher", daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def evict_audio_cache():
+    """Borrar los audios menos usados si el caché supera su tamaño máximo.
+
+    Las filas de CachedVideo se conservan (duración y tamaño siguen siendo
+    útiles para los feeds); solo se vacía ``audio_path``.
+    """
+    cached = (
+        db.session.query(CachedVideo.id, CachedVideo.audio_path, CachedVideo.file_size)
+        .filter(CachedVideo.audio_path.isnot(None))
+        .order_by(CachedVideo.last_accessed.asc())
+        .all()
+    )
+    total = sum(file_size or 0 for _, _, file_size in cached)
+    if total <= AUDIO_CACHE_MAX_BYTES:
+        return 0
+
+    target = AUDIO_CACHE_MAX_BYTES * AUDIO_CACHE_LOW_WATER
+    evicted_ids = []
+    evicted_bytes = 0
+    for video_id, audio_path, file_size in cached:
+        if total <= target:
+            break
+        if os.path.exists(audio_path):
+            os.remove(audio_path)
+        total -= file_size or 0
+        evicted_bytes += file_size or 0
+        evicted_ids.append(video_id)
+
+    CachedVideo.query.filter(CachedVideo.id.in_(evicted_ids)).update(
+        {"audio_path": None}, synchronize_session=False
+    )
+    db.session.commit()
+
+    with audio_cache_lock:
+        audio_cache_stats["evictions"] += len(evicted_ids)
+        audio_cache_stats["evicted_bytes"] += evicted_bytes
+    logger.info(f"Evicted {len(evicted_ids)} audio files ({evicted_bytes} bytes)")
+    return len(evicted_ids)
+
+
+def reconcile_audio_cache():
+    """Borrar ficheros sin fila en CachedVideo y limpiar filas sin fichero.
+
+    Los ficheros modificados recientemente se respetan: pueden ser descargas
+    en curso que todavía no tienen fila.
+    """
+    rows = dict(
+        db.session.query(CachedVideo.audio_path, CachedVideo.id)
+        .filter(CachedVideo.audio_path.isnot(None))
+        .all()
+    )
+
+    missing_ids = [video_id for path, video_id in rows.items() if not os.path.exists(path)]
+    if missing_ids:
+        CachedVideo.query.filter(CachedVideo.id.in_(missing_ids)).update(
+            {"audio_path": None}, synchronize_session=False
+        )
+        db.session.commit()
+
+    cutoff = time.time() - AUDIO_CACHE_ORPHAN_GRACE.total_seconds()
+    orphan_files = 0
+    for name in os.listdir(AUDIO_CACHE_DIR):
+        path = os.path.join(AUDIO_CACHE_DIR, name)
+        if path in rows or not os.path.isfile(path) or os.path.getmtime(path) > cutoff:
+            continue
+        os.remove(path)
+        orphan_files += 1
+
+    with audio_cache_lock:
+        audio_cache_stats["orphan_files"] += orphan_files
+        audio_cache_stats["orphan_rows"] += len(missing_ids)
+    return orphan_files, len(missing_ids)
+
+
+def audio_cache_evictor_loop():
+    """Aplicar periódicamente el límite de tamaño del caché de audio."""
+    while True:
+        time.sleep(AUDIO_CACHE_EVICT_INTERVAL)
+        try:
+            with app.app_context():
+                flush_audio_touches()
+                evict_audio_cache()
+                reconcile_audio_cache()
+        except Exception as e:
+            logger.error(f"Error limpiando el caché de audio: {e}")
+
+
+def start_audio_cache_evictor():
+    thread = threading.Thread(
+        target=audio_cache_evictor_loop, name="audio-cache-evictor", daemon=True
+    )
+    thread.start()
+    return thread
+
+
+@app.route("/audio/<video_id>")
+def stream_audio(video_id):
+    """Stream audio from the cache, or from YouTube while caching it."""
+    logger.info(f"Streaming audio for video {video_id}")
+
+    # A seek into a part of an uncached video that no download has reached:
+    # proxy just that range from the (cached) direct media URL
+    byte_range = request.range.ranges[0] if request.range and len(request.range.ranges) == 1 else None
+    if byte_range and not cached_audio_path(video_id) and not fill_covers(video_id, byte_range[0]):
+        return seek_response(video_id)
+
+    # The first listener starts a download into the cache; listeners
+    # arriving meanwhile read the same growing file
+    fill = join_stream_fill(video_id)
+
+    # Serve from the audio cache when the file is complete; send_file handles
+    # Range requests (206 / 416) and conditional requests
+    record_audio_access(video_id, hit=not fill)
+    if isinstance(fill, ForeignStreamFill) and not fill.readable:
+        # download_audio is fetching it with yt-dlp: there is no file to follow
+        return proxy_media_range(video_id, request.range.to_header() if request.range else None)
+    if not fill:
+        response = send_file(cached_audio_path(video_id), mimetype="audio/mpeg", conditional=True)
+        response.headers["Accept-Ranges"] = "bytes"
+        with stream_lock:
+            stream_stats["bytes"] += response.content_length or 0
+        return response
+
+    # Players open with "Range: bytes=0-"; answer with 206 once the final
+    # size is known, or with the whole stream (200) if it is not
+    status, headers = 200, {"Transfer-Encoding": "chunked"}
+    start, stop = 0, None
+    total = fill.length(MEDIA_RESOLVE_TIMEOUT) if byte_range else None
+    if total is not None:
+        satisfiable = request.range.range_for_length(total)
+        if not satisfiable:
+            return Response(status=416, headers={"Content-Range": f"bytes */{total}"})
+        start, stop = satisfiable
+        status = 206
+        headers = {
+            "Content-Range": f"bytes {start}-{stop - 1}/{total}",
+            "Content-Length": str(stop - start),
+        }
+    elif byte_range and byte_range[0] > 0:
+        return seek_response(video_id)
+
+    def generate():
+        try:
+            yield from fill.read(start, stop)
+        except GeneratorExit:
+            # This exception is raised when the client disconnects; the
+            # download keeps going so the cache is still filled
+            logger.info(f"Client disconnected from stream for video {video_id}")
+            raise
+
+    return Response(
+        stream_with_context(metered_stream(generate())),  # Use stream_with_context to properly handle client disconnection
+        status=status,
+        mimetype="audio/mpeg",
+        headers=dict(headers, **{"Accept-Ranges": "bytes", "Cache-Control": "no-cache"}),
+    )
+
+
+def seek_response(video_id):
+    """Serve a single range straight from YouTube (or the CBR transcoder)."""
+    record_audio_access(video_id, hit=False)
+    if AUDIO_CBR_KBPS:
+        return cbr_range_response(video_id)
+    return proxy_media_range(video_id, request.range.to_header())
+
+
+def preview_video(video):
+    """Video as returned by the JSON API (without the cached RSS fragment)."""
+    return {key: value for key, value in video.items() if key not in ("item_xml", "item_key")}
+
+
 @app.route("/preview/<feed_id>")
 def preview(feed_id):
     # First, try to find a feed with this ID
@@ -604,19 +3052,46 @@ def preview(feed_id):
             channel_id = channel.channel_id
         else:
             return jsonify({"error": "Feed or channel not found"}), 404
-    
+
+    # If we found a channel but not a feed, create a feed ID
+    if not feed:
+        feed_id = hashlib.md5(channel_id.encode()).hexdigest()
+
+    # Synced channels are answered from the database, without calling YouTube
+    channel = YouTubeChannel.query.filter_by(channel_id=channel_id).first()
+    videos = load_episodes(channel_id, limit=10)
+    if channel and videos:
+        return jsonify(
+            {
+                "channel": {
+                    "title": channel.title,
+                    "description": channel.description,
+                    "thumbnail": channel.thumbnail,
+                    "subscriber_count": channel.subscriber_count,
+                    "video_count": channel.video_count,
+                },
+                "videos": [preview_video(video) for video in videos],
+                "feed_url": url_for("view_feed", feed_id=feed_id, _external=True),
+            }
+        )
+
+    # Previews of unsynced channels are optional API spend
+    if quota_shedding():
+        return jsonify({"error": "Preview unavailable: YouTube API quota is low."}), 503
+    quota_feed.set(feed_id)
+
     channel_info = get_channel_info(channel_id)
 
     if not channel_info:
         return jsonify({"error": "Could not retrieve channel information."}), 400
 
-    videos = get_videos(channel_info["uploads_playlist_id"], max_results=10)
+    try:
+        videos = get_videos(channel_info["uploads_playlist_id"], max_results=10)
+    except (YouTubeAPIError, QuotaExceeded) as e:
+        logger.error(f"Error obteniendo videos: {e}")
+        return jsonify({"error": "Could not retrieve videos from YouTube."}), 503
     if not videos:
         return jsonify({"error": "No videos found for this channel."}), 400
-    
-    # If we found a channel but not a feed, create a feed ID
-    if not feed:
-        feed_id = hashlib.md5(channel_id.encode()).hexdigest()
 
     return jsonify(
         {
@@ -657,14 +3132,19 @@ def generate():
 
     # Create feed ID
     feed_id = hashlib.md5(channel_id.encode()).hexdigest()
+    quota_feed.set(feed_id)
 
     # Check if feed exists
     existing_feed = PodcastFeed.query.get(feed_id)
     if existing_feed:
         return jsonify({"feed_id": feed_id})
 
-    # Get videos
-    videos = get_videos(channel_info["uploads_playlist_id"])
+    # Get videos (full upload history)
+    try:
+        videos = sync_videos(channel_id, channel_info["uploads_playlist_id"])
+    except (YouTubeAPIError, QuotaExceeded) as e:
+        logger.error(f"Error obteniendo videos: {e}")
+        return jsonify({"error": "Could not retrieve videos from YouTube."}), 503
     if not videos:
         return jsonify({"error": "No videos found for this channel."}), 400
 
@@ -678,8 +3158,10 @@ def generate():
         channel_id=channel_id,
         channel_title=channel_info["title"],
         last_updated=datetime.utcnow(),
-        rss_content=rss_content,
     )
+    set_feed_content(new_feed, rss_content)
+    store_episodes(channel_id, videos)
+    plan_next_refresh(new_feed)
     db.session.add(new_feed)
     
     # Save or update channel information
@@ -707,6 +3189,8 @@ def generate():
         db.session.add(new_channel)
     
     db.session.commit()
+    # After the commit: queued prefetches are written from another connection
+    prefetch_episodes(videos)
 
     return jsonify({"feed_id": feed_id})
 
@@ -720,33 +3204,232 @@ def list_feeds():
 
 @app.route("/health")
 def health_check():
-    return jsonify({"status": "healthy"})
+    with refresh_lock:
+        refresh = dict(refresh_stats, in_flight=len(refreshes_in_flight))
+    with audio_cache_lock:
+        audio_cache = dict(audio_cache_stats)
+    with prefetch_lock:
+        prefetch = dict(prefetch_stats, pending=len(prefetches_pending))
+    with media_cache_lock:
+        media_urls = dict(media_url_stats, cached=len(media_url_cache))
+    extractor = extractor_pool.snapshot()
+    with lookup_lock:
+        lookups = dict(lookup_stats, cached=len(lookup_memory))
+    with lease_lock:
+        leases = dict(lease_stats, owner=LEASE_OWNER)
+    remaining = quota_remaining()
+    with quota_lock:
+        quota = dict(quota_stats, budget=QUOTA_DAILY_BUDGET, remaining=remaining)
+    with job_lock:
+        jobs = dict(job_stats, enabled=JOB_QUEUE_ENABLED)
+    return jsonify({
+        "status": "healthy",
+        "refresh": refresh,
+        "audio_cache": audio_cache,
+        "prefetch": prefetch,
+        "media_urls": media_urls,
+        "extractor": extractor,
+        "lookups": lookups,
+        "leases": leases,
+        "quota": quota,
+        "jobs": jobs,
+    })
+
+
+def ratio(hits, misses):
+    total = hits + misses
+    return hits / total if total else 0
+
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus metrics for this process."""
+    with refresh_lock:
+        refresh = dict(refresh_stats, in_flight=len(refreshes_in_flight))
+    with audio_cache_lock:
+        audio_cache = dict(audio_cache_stats)
+    with prefetch_lock:
+        prefetch = dict(prefetch_stats, pending=len(prefetches_pending))
+    with media_cache_lock:
+        media_urls = dict(media_url_stats, cached=len(media_url_cache))
+    with lookup_lock:
+        lookups = dict(lookup_stats)
+    with quota_lock:
+        quota = dict(quota_stats)
+    with lease_lock:
+        leases = dict(lease_stats)
+    with job_lock:
+        jobs = dict(job_stats)
+    queues = job_queue_depth()
+    with stream_lock:
+        streams = dict(stream_stats)
+    with stream_fills_lock:
+        fills = len(stream_fills)
+    extractor = extractor_pool.snapshot()
+
+    def counters(name, help_text, label, stats, keys):
+        return format_family(name, "counter", help_text, [({label: key}, stats[key]) for key in keys])
+
+    families = [
+        request_latency.render(),
+        refresh_duration.render(),
+        counters("podtube_feed_refreshes_total", "Feed refreshes by outcome.", "outcome",
+                 refresh, ("scheduled", "coalesced", "rejected", "completed", "failed", "throttled")),
+        format_family("podtube_feed_refreshes_in_flight", "gauge", "Feed refreshes queued or running.",
+                      [(None, refresh["in_flight"])]),
+        format_family("podtube_audio_streams_active", "gauge", "Audio responses being streamed.",
+                      [(None, streams["active"])]),
+        format_family("podtube_audio_streams_total", "counter", "Streamed audio responses started.",
+                      [(None, streams["started"])]),
+        format_family("podtube_audio_sent_bytes_total", "counter", "Audio bytes sent to clients.",
+                      [(None, streams["bytes"])]),
+        format_family("podtube_audio_stream_fills_active", "gauge", "Downloads filling the audio cache.",
+                      [(None, fills)]),
+        format_family("podtube_ffmpeg_processes", "gauge", "Running ffmpeg transcoders.",
+                      [(None, streams["transcoders"])]),
+        format_family("podtube_ytdlp_workers", "gauge", "yt-dlp worker processes by state.", [
+            ({"state": "idle"}, extractor["idle"]),
+            ({"state": "busy"}, extractor["running"] - extractor["idle"]),
+        ]),
+        counters("podtube_ytdlp_events_total", "yt-dlp worker spawns, jobs and failures.", "event",
+                 extractor, ("spawned", "jobs", "errors", "timeouts", "crashes", "recycled")),
+        counters("podtube_audio_cache_events_total", "Audio cache lookups and evictions.", "event",
+                 audio_cache, ("hits", "misses", "evictions", "orphan_files", "orphan_rows")),
+        format_family("podtube_audio_cache_hit_ratio", "gauge", "Audio cache hit ratio since start.",
+                      [(None, ratio(audio_cache["hits"], audio_cache["misses"]))]),
+        counters("podtube_media_url_events_total", "Direct media URL cache events.", "event",
+                 media_urls, ("hits", "resolves", "failures", "expired")),
+        format_family("podtube_media_url_cache_hit_ratio", "gauge", "Media URL cache hit ratio since start.",
+                      [(None, ratio(media_urls["hits"], media_urls["resolves"]))]),
+        counters("podtube_lookup_events_total", "Channel lookup cache events.", "event",
+                 lookups, ("memory_hits", "db_hits", "misses", "negative_hits")),
+        counters("podtube_prefetch_events_total", "Episode prefetch events.", "event",
+                 prefetch, ("queued", "skipped", "rejected", "completed", "failed")),
+        counters("podtube_lease_events_total", "Cross-process lease attempts.", "event",
+                 leases, ("acquired", "contended")),
+        counters("podtube_youtube_api_events_total", "YouTube API calls, units and shed calls.", "event",
+                 quota, ("calls", "units", "shed", "rejected")),
+        counters("podtube_job_events_total", "Queue jobs enqueued and finished by this process.", "event",
+                 jobs, ("enqueued", "deduplicated", "completed", "retried", "throttled", "dead")),
+        format_family("podtube_jobs", "gauge", "Queue jobs by kind and status.", [
+            ({"kind": kind, "status": status}, queue[status])
+            for kind, queue in sorted(queues.items())
+            for status in ("queued", "running", "dead")
+        ]),
+        format_family("podtube_job_oldest_queued_seconds", "gauge", "Age of the oldest queued job.",
+                      [({"kind": kind}, queue["oldest_queued_seconds"]) for kind, queue in sorted(queues.items())]),
+    ]
+    return Response("\n".join(families) + "\n", mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/api/jobs", methods=["GET"])
+def list_jobs():
+    """Report job queue depth and age, and list jobs by status."""
+    status = request.args.get("status", "dead")
+    query = Job.query.filter_by(status=status)
+    if request.args.get("kind"):
+        query = query.filter_by(kind=request.args["kind"])
+    jobs = query.order_by(Job.id.desc()).limit(request.args.get("limit", 50, type=int)).all()
+
+    return jsonify({
+        "enabled": JOB_QUEUE_ENABLED,
+        "queues": job_queue_depth(),
+        "jobs": [
+            {
+                "id": job.id,
+                "kind": job.kind,
+                "target": job.target,
+                "status": job.status,
+                "priority": job.priority,
+                "attempts": job.attempts,
+                "max_attempts": job.max_attempts,
+                "run_after": job.run_after.isoformat() if job.run_after else None,
+                "created_at": job.created_at.isoformat() if job.created_at else None,
+                "locked_by": job.locked_by,
+                "last_error": job.last_error,
+            }
+            for job in jobs
+        ],
+    })
+
+
+@app.route("/api/jobs/<int:job_id>/retry", methods=["POST"])
+def retry_job(job_id):
+    """Requeue a dead job."""
+    job = Job.query.get_or_404(job_id)
+    if job.status != "dead":
+        return jsonify({"error": "Only dead jobs can be retried"}), 409
+    if Job.query.filter(
+        Job.dedup_key == job.dedup_key, Job.status.in_(("queued", "running"))
+    ).first():
+        return jsonify({"error": "An equivalent job is already queued"}), 409
+
+    job.status = "queued"
+    job.attempts = 0
+    job.run_after = datetime.utcnow()
+    db.session.commit()
+    return jsonify({"id": job.id, "status": job.status})
+
+
+@app.route("/api/quota", methods=["GET"])
+def quota_report():
+    """Report YouTube API quota spend per day, endpoint and feed."""
+    days = request.args.get("days", 1, type=int)
+    report_days = [
+        day for day, in db.session.query(QuotaUsage.day)
+        .distinct().order_by(QuotaUsage.day.desc()).limit(max(days, 1))
+    ]
+    rows = QuotaUsage.query.filter(QuotaUsage.day.in_(report_days)).all()
+    feed_titles = dict(db.session.query(PodcastFeed.id, PodcastFeed.channel_title).all())
+
+    report = []
+    for day in report_days:
+        by_endpoint = {}
+        by_feed = {}
+        for row in rows:
+            if row.day != day:
+                continue
+            endpoint = by_endpoint.setdefault(row.endpoint, {"units": 0, "calls": 0})
+            endpoint["units"] += row.units
+            endpoint["calls"] += row.calls
+            feed = by_feed.setdefault(row.feed_id or "none", {
+                "title": feed_titles.get(row.feed_id),
+                "units": 0,
+                "calls": 0,
+            })
+            feed["units"] += row.units
+            feed["calls"] += row.calls
+        report.append({
+            "day": day,
+            "units": sum(endpoint["units"] for endpoint in by_endpoint.values()),
+            "by_endpoint": by_endpoint,
+            "by_feed": by_feed,
+        })
+
+    return jsonify({
+        "budget": QUOTA_DAILY_BUDGET,
+        "reserve": QUOTA_RESERVE_UNITS,
+        "today": quota_day(),
+        "remaining": quota_remaining(),
+        "shedding": quota_shedding(),
+        "days": report,
+    })
 
 
 @app.route("/cleanup")
 def cleanup():
-    """Limpiar archivos de audio no utilizados (solo para administradores)."""
+    """Aplicar ahora el límite del caché de audio (solo para administradores)."""
     # Verificar si es administrador (implementar autenticación si es necesario)
     if request.args.get("key") != os.getenv("ADMIN_KEY", "admin"):
         return "Acceso denegado", 403
 
-    # Encontrar videos no accedidos en más de 30 días
-    month_ago = datetime.utcnow() - timedelta(days=30)
-    old_videos = CachedVideo.query.filter(CachedVideo.last_accessed < month_ago).all()
-
-    count = 0
-    for video in old_videos:
-        if video.audio_path and os.path.exists(video.audio_path):
-            # Eliminar archivo
-            os.remove(video.audio_path)
-            count += 1
+    flush_audio_touches()
+    count = evict_audio_cache()
+    orphan_files, _ = reconcile_audio_cache()
+    purge_lookup_cache()
+    purge_jobs()
 
-        # Eliminar registro
-        db.session.delete(video)
-
-    db.session.commit()
-
-    return f"Limpieza completada. {count} archivos eliminados."
+    return f"Limpieza completada. {count + orphan_files} archivos eliminados."
 
 
 # API endpoints for YouTube channel management
@@ -837,12 +3520,13 @@ def create_channel():
     # Crear feed automáticamente
     try:
         feed_id = hashlib.md5(real_channel_id.encode()).hexdigest()
+        quota_feed.set(feed_id)
         
         # Verificar si ya existe un feed para este canal
         existing_feed = PodcastFeed.query.get(feed_id)
         if not existing_feed:
-            # Obtener videos para el feed
-            videos = get_videos(channel_info["uploads_playlist_id"])
+            # Obtener videos para el feed (historial completo)
+            videos = sync_videos(real_channel_id, channel_info["uploads_playlist_id"])
             
             # Generar contenido RSS
             base_url = os.getenv("BASE_URL", request.url_root.rstrip("/"))
@@ -852,12 +3536,16 @@ def create_channel():
             new_feed = PodcastFeed(
                 id=feed_id,
                 channel_id=real_channel_id,
-                channel_title=new_channel.title,
-                rss_content=rss_content
+                channel_title=new_channel.title
             )
+            set_feed_content(new_feed, rss_content)
+            store_episodes(real_channel_id, videos)
+            plan_next_refresh(new_feed)
             
             db.session.add(new_feed)
             db.session.commit()
+            # Después del commit: los trabajos de la cola se escriben desde otra conexión
+            prefetch_episodes(videos)
     except Exception as e:
         logger.error(f"Error al crear feed automáticamente: {e}")
         # No fallar la creación del canal si hay un error al crear el feed
@@ -891,6 +3579,7 @@ def create_feed():
     
     # Generar ID del feed
     feed_id = hashlib.md5(channel.channel_id.encode()).hexdigest()
+    quota_feed.set(feed_id)
     
     # Verificar si ya existe un feed
     existing_feed = PodcastFeed.query.get(feed_id)
@@ -908,8 +3597,12 @@ def create_feed():
     if not channel_info:
         return jsonify({"error": "No se pudo obtener información del canal"}), 400
     
-    # Obtener videos
-    videos = get_videos(channel_info["uploads_playlist_id"])
+    # Obtener videos (historial completo)
+    try:
+        videos = sync_videos(channel.channel_id, channel_info["uploads_playlist_id"])
+    except (YouTubeAPIError, QuotaExceeded) as e:
+        logger.error(f"Error obteniendo videos: {e}")
+        return jsonify({"error": "No se pudieron obtener los videos desde YouTube"}), 503
     
     # Generar contenido RSS
     base_url = os.getenv("BASE_URL", request.url_root.rstrip("/"))
@@ -919,12 +3612,16 @@ def create_feed():
     new_feed = PodcastFeed(
         id=feed_id,
         channel_id=channel.channel_id,
-        channel_title=channel.title,
-        rss_content=rss_content
+        channel_title=channel.title
     )
+    set_feed_content(new_feed, rss_content)
+    store_episodes(channel.channel_id, videos)
+    plan_next_refresh(new_feed)
     
     db.session.add(new_feed)
     db.session.commit()
+    # After the commit: queued prefetches are written from another connection
+    prefetch_episodes(videos)
     
     return jsonify({
         "id": new_feed.id,
@@ -1000,6 +3697,379 @@ def check_feed(feed_id):
     })
 
 
+# Importación de suscripciones en OPML. Cada importación se ejecuta en segundo
+# plano en tres fases: resolver los handles y URLs a IDs de canal (en paralelo,
+# acotado), pedir los metadatos con channels.list en bloques de 50 y construir
+# los feeds nuevos (también en paralelo). El proceso que la ejecuta guarda el
+# progreso en OpmlImport, así que se puede consultar desde cualquier trabajador.
+# Con JOB_QUEUE_ENABLED la importación es un trabajo de la cola (la ejecuta
+# worker.py y sobrevive a reinicios); si no, un hilo de la web, y si su
+# proceso muere la importación se da por fallida al consultarla.
+OPML_IMPORT_MAX_CHANNELS = int(os.getenv("OPML_IMPORT_MAX_CHANNELS", 1000))
+OPML_RESOLVE_WORKERS = int(os.getenv("OPML_RESOLVE_WORKERS", 8))
+OPML_BUILD_WORKERS = int(os.getenv("OPML_BUILD_WORKERS", 4))
+OPML_PROGRESS_INTERVAL = 1  # Segundos entre escrituras del progreso
+OPML_IMPORT_RETENTION = timedelta(days=7)
+OPML_IMPORT_TIMEOUT = timedelta(minutes=int(os.getenv("OPML_IMPORT_TIMEOUT_MINUTES", 120)))
+OPML_IMPORT_STALE_AFTER = timedelta(minutes=10)  # Sin progreso ni trabajo pendiente: huérfana
+CHANNEL_ID_PATTERN = re.compile(r"UC[\w-]{22}")
+
+opml_saved_at = {}  # import_id -> última escritura del progreso (monotonic)
+opml_lock = threading.Lock()
+
+
+def normalize_channel_url(value):
+    """Convertir un handle, ID o URL de canal en algo que entienda get_channel_id."""
+    value = value.strip()
+    if CHANNEL_ID_PATTERN.fullmatch(value):
+        return f"https://www.youtube.com/channel/{value}"
+    if "youtube.com" in value or "youtu.be" in value:
+        return value
+    return f"https://www.youtube.com/@{value.lstrip('@')}"
+
+
+def parse_opml(content):
+    """Extraer las URLs de canal de un documento OPML.
+
+    Se usa ``xmlUrl`` (feed RSS del canal) o, si no hay, ``htmlUrl``.
+    Lanza ET.ParseError si el documento no es XML válido.
+    """
+    root = ET.fromstring(content)
+    urls = []
+    for outline in root.iter("outline"):
+        url = outline.get("xmlUrl") or outline.get("htmlUrl") or outline.get("url")
+        if url and ("youtube.com" in url or "youtu.be" in url):
+            urls.append(url.strip())
+    return urls
+
+
+def update_import(progress, **counts):
+    with opml_lock:
+        for name, value in counts.items():
+            progress[name] += value
+    save_import(progress)
+
+
+def save_import(progress, force=False):
+    """Guardar el progreso en SQLite, como mucho cada OPML_PROGRESS_INTERVAL salvo ``force``."""
+    now = time.monotonic()
+    with opml_lock:
+        if not force and now - opml_saved_at.get(progress["id"], 0) < OPML_PROGRESS_INTERVAL:
+            return
+        opml_saved_at[progress["id"]] = now
+    snapshot = import_progress(progress)
+
+    finished_at = snapshot["finished_at"] and datetime.fromisoformat(snapshot["finished_at"])
+    statement = sqlite_insert(OpmlImport).values(
+        id=snapshot["id"],
+        status=snapshot["status"],
+        progress=snapshot,
+        started_at=datetime.fromisoformat(snapshot["started_at"]),
+        updated_at=datetime.utcnow(),
+        finished_at=finished_at,
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[OpmlImport.id],
+        set_={
+            "status": statement.excluded.status,
+            "progress": statement.excluded.progress,
+            "updated_at": statement.excluded.updated_at,
+            "finished_at": statement.excluded.finished_at,
+        },
+    )
+    with app.app_context(), db.engine.begin() as connection:
+        connection.execute(statement)
+
+
+def resolve_import_url(url):
+    with app.app_context():
+        return get_channel_id(url)
+
+
+def build_imported_feed(channel_id, channel_info, base_url):
+    """Crear el feed (y el canal) de una suscripción importada.
+
+    Devuelve ``(feed_id, creado)``.
+    """
+    feed_id = hashlib.md5(channel_id.encode()).hexdigest()
+    with app.app_context():
+        quota_feed.set(feed_id)
+        if PodcastFeed.query.get(feed_id):
+            return feed_id, False
+
+        videos = sync_videos(channel_id, channel_info["uploads_playlist_id"])
+        if not videos:
+            raise ValueError("no videos found for this channel")
+
+        feed = PodcastFeed(
+            id=feed_id,
+            channel_id=channel_id,
+            channel_title=channel_info["title"],
+            last_updated=datetime.utcnow(),
+        )
+        set_feed_content(feed, generate_rss(channel_info, videos, base_url, feed_id))
+        store_episodes(channel_id, videos)
+        plan_next_refresh(feed)
+        db.session.add(feed)
+
+        if not YouTubeChannel.query.filter_by(channel_id=channel_id).first():
+            db.session.add(YouTubeChannel(
+                id=hashlib.sha256(channel_id.encode()).hexdigest(),
+                channel_id=channel_id,
+                title=channel_info["title"],
+                description=channel_info.get("description", ""),
+                thumbnail=channel_info.get("thumbnail", ""),
+                subscriber_count=channel_info.get("subscriber_count", 0),
+                video_count=len(videos),
+            ))
+        db.session.commit()
+        prefetch_episodes(videos)
+    return feed_id, True
+
+
+def run_opml_import(progress, urls, base_url):
+    """Importar una lista de URLs de canal actualizando ``progress``."""
+    def fail(url, error):
+        with opml_lock:
+            progress["failed"] += 1
+            progress["errors"].append({"url": url, "error": error})
+        save_import(progress)
+
+    try:
+        # 1. URLs y handles -> IDs de canal
+        channel_urls = {}  # channel_id -> primera URL que lo nombra
+        with ThreadPoolExecutor(max_workers=OPML_RESOLVE_WORKERS) as executor:
+            for url, channel_id in zip(urls, executor.map(resolve_import_url, urls)):
+                update_import(progress, resolved=1)
+                if not channel_id:
+                    fail(url, "could not resolve channel")
+                elif channel_id in channel_urls:
+                    update_import(progress, duplicates=1)
+                else:
+                    channel_urls[channel_id] = url
+
+        # 2. Metadatos en bloques de 50 canales por llamada
+        with opml_lock:
+            progress["status"] = "fetching"
+        save_import(progress, force=True)
+        with app.app_context():
+            infos = get_channel_infos(list(channel_urls))
+
+        # 3. Construir los feeds nuevos
+        with opml_lock:
+            progress["status"] = "building"
+        save_import(progress, force=True)
+
+        def build(channel_id):
+            try:
+                feed_id, created = build_imported_feed(channel_id, infos[channel_id], base_url)
+            except Exception as e:
+                return fail(channel_urls[channel_id], str(e))
+            with opml_lock:
+                progress["created" if created else "existing"] += 1
+                progress["feeds"].append({"url": channel_urls[channel_id], "feed_id": feed_id})
+            save_import(progress)
+
+        ready = []
+        for channel_id, url in channel_urls.items():
+            if infos.get(channel_id):
+                ready.append(channel_id)
+            else:
+                fail(url, "could not retrieve channel information")
+        with ThreadPoolExecutor(max_workers=OPML_BUILD_WORKERS) as executor:
+            list(executor.map(build, ready))
+
+        status = "done"
+    except Exception as e:
+        logger.error(f"Error importando OPML: {e}")
+        status = "failed"
+
+    with opml_lock:
+        progress["status"] = status
+        progress["finished_at"] = datetime.utcnow().isoformat()
+    try:
+        save_import(progress, force=True)
+    finally:
+        with opml_lock:
+            opml_saved_at.pop(progress["id"], None)
+
+
+def new_import_progress(import_id, urls):
+    return {
+        "id": import_id,
+        "status": "resolving",
+        "total": len(urls),
+        "resolved": 0,
+        "duplicates": 0,
+        "created": 0,
+        "existing": 0,
+        "failed": 0,
+        "feeds": [],
+        "errors": [],
+        "started_at": datetime.utcnow().isoformat(),
+        "finished_at": None,
+    }
+
+
+def start_opml_import(urls, base_url):
+    """Lanzar una importación en segundo plano y devolver su progreso."""
+    progress = new_import_progress(uuid.uuid4().hex, urls)
+    with app.app_context(), db.engine.begin() as connection:
+        connection.execute(
+            db.delete(OpmlImport).where(
+                OpmlImport.started_at < datetime.utcnow() - OPML_IMPORT_RETENTION
+            )
+        )
+    save_import(progress, force=True)
+
+    if JOB_QUEUE_ENABLED:
+        enqueue_job("opml", progress["id"], payload={"urls": urls, "base_url": base_url})
+    else:
+        thread = threading.Thread(
+            target=run_opml_import, args=(progress, urls, base_url), name="opml-import", daemon=True
+        )
+        thread.start()
+    return progress
+
+
+def opml_import_job(import_id, payload):
+    # Si el trabajo se repite (su proceso murió) la importación empieza de
+    # nuevo; los feeds ya creados cuentan como existentes
+    run_opml_import(new_import_progress(import_id, payload["urls"]), payload["urls"], payload["base_url"])
+
+
+JOB_HANDLERS["opml"] = opml_import_job
+JOB_PRIORITIES["opml"] = 5
+JOB_TIMEOUTS["opml"] = OPML_IMPORT_TIMEOUT
+
+
+def expire_orphaned_import(opml_import):
+    """Dar por fallida una importación sin progreso reciente ni trabajo pendiente.
+
+    Pasa cuando muere el proceso que la ejecutaba en un hilo. Devuelve True
+    si la ha marcado (sin hacer commit).
+    """
+    if opml_import.status in ("done", "failed"):
+        return False
+    if opml_import.updated_at > datetime.utcnow() - OPML_IMPORT_STALE_AFTER:
+        return False
+    pending = Job.query.filter(
+        Job.dedup_key == f"opml:{opml_import.id}", Job.status.in_(("queued", "running"))
+    ).first()
+    if pending:
+        return False
+
+    now = datetime.utcnow()
+    error = f"import stopped making progress at {opml_import.updated_at.isoformat()}"
+    opml_import.status = "failed"
+    opml_import.finished_at = now
+    opml_import.progress = dict(
+        opml_import.progress,
+        status="failed",
+        finished_at=now.isoformat(),
+        errors=opml_import.progress["errors"] + [{"url": None, "error": error}],
+    )
+    logger.warning(f"OPML import {opml_import.id} orphaned: {error}")
+    return True
+
+
+def import_progress(progress):
+    with opml_lock:
+        return dict(progress, feeds=list(progress["feeds"]), errors=list(progress["errors"]))
+
+
+@app.route("/api/opml", methods=["POST"])
+def import_opml():
+    """Import channel subscriptions from an OPML file.
+
+    Accepts an uploaded ``file``, a raw OPML body, or JSON ``{"urls": [...]}``
+    with channel URLs, handles or IDs. The import runs in the background;
+    poll the returned ``status_url`` for progress.
+    """
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get("urls", []), list):
+            return jsonify({"error": 'Expected a JSON object like {"urls": [...]}'}), 400
+        urls = [url for url in data.get("urls", []) if isinstance(url, str) and url.strip()]
+    else:
+        upload = request.files.get("file")
+        content = upload.read() if upload else request.get_data()
+        try:
+            urls = parse_opml(content)
+        except ET.ParseError as e:
+            return jsonify({"error": f"Invalid OPML: {e}"}), 400
+
+    urls = list(dict.fromkeys(normalize_channel_url(url) for url in urls))
+    if not urls:
+        return jsonify({"error": "No YouTube channels found"}), 400
+    if len(urls) > OPML_IMPORT_MAX_CHANNELS:
+        return jsonify({
+            "error": f"Too many channels ({len(urls)}), the limit is {OPML_IMPORT_MAX_CHANNELS}"
+        }), 413
+
+    base_url = os.getenv("BASE_URL", request.url_root.rstrip("/")).rstrip("/")
+    progress = start_opml_import(urls, base_url)
+    response = import_progress(progress)
+    response["status_url"] = url_for("opml_import_status", import_id=progress["id"], _external=True)
+    return jsonify(response), 202
+
+
+@app.route("/api/opml/imports/<import_id>", methods=["GET"])
+def opml_import_status(import_id):
+    """Report the progress of an OPML import."""
+    opml_import = db.session.get(OpmlImport, import_id)
+    if not opml_import:
+        return jsonify({"error": "Import not found"}), 404
+    if expire_orphaned_import(opml_import):
+        db.session.commit()
+    return jsonify(dict(opml_import.progress, updated_at=opml_import.updated_at.isoformat()))
+
+
+def opml_outline(feed, base_url):
+    title = xml_escape(feed.channel_title, {'"': "&quot;"})
+    return (
+        f'\n    <outline type="rss" text="{title}" title="{title}" '
+        f'xmlUrl="{base_url}/feed/{feed.id}" '
+        f'htmlUrl="https://www.youtube.com/channel/{xml_escape(feed.channel_id)}"/>'
+    )
+
+
+@app.route("/api/opml", methods=["GET"])
+def export_opml():
+    """Export every feed as OPML, straight from the database."""
+    base_url = os.getenv("BASE_URL", request.url_root.rstrip("/")).rstrip("/")
+    feeds = (
+        db.session.query(PodcastFeed.id, PodcastFeed.channel_id, PodcastFeed.channel_title)
+        .order_by(PodcastFeed.channel_title)
+        .all()
+    )
+    outlines = "".join(opml_outline(feed, base_url) for feed in feeds)
+    opml = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<opml version="2.0">\n'
+        "  <head>\n"
+        "    <title>PodTube subscriptions</title>\n"
+        f"    <dateCreated>{datetime.now(timezone.utc).strftime('%a, %d %b %Y %H:%M:%S GMT')}</dateCreated>\n"
+        "  </head>\n"
+        f"  <body>{outlines}\n  </body>\n"
+        "</opml>\n"
+    )
+    response = Response(opml, mimetype="text/x-opml")
+    response.headers["Content-Disposition"] = 'attachment; filename="podtube.opml"'
+    return response
+
+
+with app.app_context():
+    migrate_feed_episodes()
+    rebuild_feed_layouts()
+
+if REFRESH_SCHEDULER_ENABLED:
+    start_refresh_scheduler()
+if AUDIO_CACHE_EVICTOR_ENABLED:
+    start_audio_cache_evictor()
+start_access_flusher()
+
+
 if __name__ == "__main__":
     # Obtener puerto de las variables de entorno o usar 5000 por defecto
     port = int(os.environ.get("PORT", 5000))
@@ -0,0 +1,459 @@
+"""Servidor asyncio para el streaming de audio.
+
+Con el servidor WSGI cada oyente de ``/audio/<video_id>`` ocupa un trabajador
+durante todo el episodio. Este servidor (aiohttp) atiende el audio en el bucle
+de eventos: el proxy de rangos y ffmpeg se leen sin bloquear y cada conexión
+solo retiene un bloque en memoria gracias al control de flujo de aiohttp, así
+que un proceso aguanta miles de oyentes lentos.
+
+El resto de rutas (feeds, API, estáticos) se pasan a la aplicación Flask en
+su propio pool de hilos, y su respuesta se envía por partes según la produce.
+Las llamadas bloqueantes del audio (resolver la URL con yt-dlp, arrancar un
+volcado) usan otro pool, para que una resolución lenta no retrase los feeds.
+Uso::
+
+    python async_server.py
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from io import BytesIO
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, web
+from werkzeug.http import parse_range_header
+
+import app as podtube
+
+logger = logging.getLogger(__name__)
+
+ASYNC_WSGI_THREADS = int(os.getenv("ASYNC_WSGI_THREADS", 16))
+ASYNC_MEDIA_THREADS = int(os.getenv("ASYNC_MEDIA_THREADS", 16))
+ASYNC_UPSTREAM_CONNECTIONS = int(os.getenv("ASYNC_UPSTREAM_CONNECTIONS", 500))
+STREAM_CHUNK_SIZE = 64 * 1024
+# Cada cuánto se mira si un volcado en curso ha escrito más bytes
+FILL_POLL_INTERVAL = 0.25
+# Partes de una respuesta WSGI que pueden esperar a ser enviadas
+WSGI_QUEUE_CHUNKS = 16
+
+# Cabeceras de la conexión WSGI que no deben reenviarse
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "content-length"}
+
+
+async def run_blocking(function, *args):
+    """Ejecutar código bloqueante del audio en el pool por defecto (ASYNC_MEDIA_THREADS)."""
+    return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+
+@contextmanager
+def metered_stream():
+    """Contar el stream como activo; el contador devuelto acumula los bytes."""
+    sent = [0]
+    with podtube.stream_lock:
+        podtube.stream_stats["active"] += 1
+        podtube.stream_stats["started"] += 1
+    try:
+        yield sent
+    finally:
+        with podtube.stream_lock:
+            podtube.stream_stats["active"] -= 1
+            podtube.stream_stats["bytes"] += sent[0]
+
+
+async def proxy_media_range(request, video_id, range_header):
+    """Equivalente asíncrono de podtube.proxy_media_range."""
+    media = await run_blocking(podtube.get_media, video_id)
+    upstream = None
+    for attempt in range(2):
+        if not media:
+            return web.json_response({"error": "Could not resolve audio stream"}, status=502)
+
+        headers = dict(media["headers"])
+        if range_header:
+            headers["Range"] = range_header
+        upstream = await request.app["http"].get(media["url"], headers=headers)
+        if upstream.status in (403, 410) and attempt == 0:
+            upstream.release()
+            with podtube.media_cache_lock:
+                podtube.media_url_stats["expired"] += 1
+            media = await run_blocking(podtube.get_media, video_id, True)
+            continue
+        break
+
+    try:
+        if upstream.status == 416:
+            response = web.Response(status=416)
+            if media["filesize"]:
+                response.headers["Content-Range"] = f"bytes */{media['filesize']}"
+            return response
+        if upstream.status not in (200, 206):
+            logger.error(f"Upstream returned {upstream.status} for video {video_id}")
+            return web.json_response({"error": "Upstream error"}, status=502)
+
+        response = web.StreamResponse(
+            status=upstream.status,
+            headers={"Accept-Ranges": "bytes", "Cache-Control": "no-cache"},
+        )
+        response.content_type = "audio/mpeg"
+        for header in ("Content-Range", "Content-Length"):
+            if header in upstream.headers:
+                response.headers[header] = upstream.headers[header]
+
+        await response.prepare(request)
+        with metered_stream() as sent:
+            async for chunk in upstream.content.iter_chunked(STREAM_CHUNK_SIZE):
+                await response.write(chunk)
+                sent[0] += len(chunk)
+        await response.write_eof()
+        return response
+    finally:
+        upstream.release()
+
+
+async def cbr_range_response(request, video_id, byte_ranges):
+    """Equivalente asíncrono de podtube.cbr_range_response."""
+    media = await run_blocking(podtube.get_media, video_id)
+    total = media and await run_blocking(podtube.cbr_feed_length, video_id, media)
+    if not total:
+        return web.json_response({"error": "Could not resolve audio stream"}, status=502)
+
+    byte_range = byte_ranges.range_for_length(total)
+    if not byte_range:
+        return web.Response(status=416, headers={"Content-Range": f"bytes */{total}"})
+
+    start, stop = byte_range
+    process = await asyncio.create_subprocess_exec(
+        *podtube.cbr_transcoder_command(media, start),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    with podtube.stream_lock:
+        podtube.stream_stats["transcoders"] += 1
+
+    try:
+        response = web.StreamResponse(
+            status=206,
+            headers={
+                "Accept-Ranges": "bytes",
+                "Cache-Control": "no-cache",
+                "Content-Range": f"bytes {start}-{stop - 1}/{total}",
+                "Content-Length": str(stop - start),
+            },
+        )
+        response.content_type = "audio/mpeg"
+        await response.prepare(request)
+
+        # Igual que read_exact: recortar o rellenar con ceros hasta el tamaño anunciado
+        remaining = stop - start
+        with metered_stream() as sent:
+            while remaining > 0:
+                chunk = await process.stdout.read(min(STREAM_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await response.write(chunk)
+                sent[0] += len(chunk)
+            while remaining > 0:
+                padding = min(STREAM_CHUNK_SIZE, remaining)
+                remaining -= padding
+                await response.write(bytes(padding))
+                sent[0] += padding
+        await response.write_eof()
+        return response
+    finally:
+        if process.returncode is None:
+            process.kill()
+        await process.wait()
+        with podtube.stream_lock:
+            podtube.stream_stats["transcoders"] -= 1
+
+
+def fill_progress(fill):
+    return fill.done, fill.written
+
+
+async def stream_fill_response(request, fill, start=0, stop=None, total=None):
+    """Enviar el fichero que está llenando un StreamFill, esperando a que crezca.
+
+    Con ``total`` se responde 206 con el rango ``start``-``stop``; si no, 200
+    con el fichero entero.
+    """
+    response = web.StreamResponse(
+        headers={"Accept-Ranges": "bytes", "Cache-Control": "no-cache"}
+    )
+    response.content_type = "audio/mpeg"
+    if total is None:
+        response.enable_chunked_encoding()
+    else:
+        response.set_status(206)
+        response.headers["Content-Range"] = f"bytes {start}-{stop - 1}/{total}"
+        response.content_length = stop - start
+    await response.prepare(request)
+
+    try:
+        part_file = open(fill.part_path, "rb")
+    except FileNotFoundError:
+        # El volcado acaba de terminar (o de fallar)
+        if not os.path.exists(fill.path):
+            await response.write_eof()
+            return response
+        part_file = open(fill.path, "rb")
+
+    # El estado de un volcado de otro proceso se mira en disco y en SQLite
+    foreign = isinstance(fill, podtube.ForeignStreamFill)
+    with part_file, metered_stream() as sent:
+        part_file.seek(start)
+        position = start
+        while stop is None or position < stop:
+            size = STREAM_CHUNK_SIZE if stop is None else min(STREAM_CHUNK_SIZE, stop - position)
+            chunk = part_file.read(size)
+            if chunk:
+                await response.write(chunk)
+                position += len(chunk)
+                sent[0] += len(chunk)
+                continue
+
+            done, written = await run_blocking(fill_progress, fill) if foreign else fill_progress(fill)
+            if done and written <= position:
+                break
+            if written <= position:
+                await asyncio.sleep(FILL_POLL_INTERVAL)
+
+    await response.write_eof()
+    return response
+
+
+async def stream_audio(request):
+    """Stream audio from the cache, or from YouTube while caching it.
+
+    Same behaviour as the Flask ``stream_audio`` view, without holding a
+    thread per listener.
+    """
+    request["latency_started"] = time.perf_counter()
+    video_id = request.match_info["video_id"]
+    logger.info(f"Streaming audio for video {video_id}")
+
+    try:
+        return await audio_response(request, video_id)
+    except ConnectionResetError:
+        # The client disconnected; a download into the cache keeps going
+        logger.info(f"Client disconnected from stream for video {video_id}")
+        record_audio_latency(request, 499)
+        raise
+    except Exception:
+        record_audio_latency(request, 500)
+        raise
+
+
+def record_audio_latency(request, status):
+    """Observe the time until the response headers, once per request."""
+    started = request.pop("latency_started", None)
+    if started is not None:
+        podtube.request_latency.observe(
+            time.perf_counter() - started, "/audio/<video_id>", request.method, str(status)
+        )
+
+
+async def on_response_prepare(request, response):
+    # Called right before the headers are sent, when the status is final: a
+    # FileResponse only turns into 206, 304 or 416 when aiohttp prepares it
+    # after the handler returns
+    record_audio_latency(request, response.status)
+
+
+async def seek_response(request, video_id, byte_ranges):
+    """Serve a single range straight from YouTube (or the CBR transcoder)."""
+    podtube.record_audio_access(video_id, hit=False)
+    if podtube.AUDIO_CBR_KBPS:
+        return await cbr_range_response(request, video_id, byte_ranges)
+    return await proxy_media_range(request, video_id, byte_ranges.to_header())
+
+
+def fill_readable(fill):
+    return not isinstance(fill, podtube.ForeignStreamFill) or fill.readable
+
+
+async def audio_response(request, video_id):
+    byte_ranges = parse_range_header(request.headers.get("Range"))
+    byte_range = byte_ranges.ranges[0] if byte_ranges and len(byte_ranges.ranges) == 1 else None
+
+    # Same routing as the Flask view: only seeks past what a download into
+    # the cache has reached are proxied
+    if byte_range and not await run_blocking(podtube.cached_audio_path, video_id):
+        if not await run_blocking(podtube.fill_covers, video_id, byte_range[0]):
+            return await seek_response(request, video_id, byte_ranges)
+
+    # The first listener starts a download into the cache; listeners
+    # arriving meanwhile read the same growing file
+    fill = await run_blocking(podtube.join_stream_fill, video_id)
+    podtube.record_audio_access(video_id, hit=not fill)
+    if fill and not await run_blocking(fill_readable, fill):
+        # download_audio is fetching it with yt-dlp: there is no file to follow
+        return await proxy_media_range(request, video_id, byte_ranges.to_header() if byte_ranges else None)
+    if not fill:
+        # FileResponse handles Range requests (206 / 416) and conditional requests
+        path = podtube.cached_audio_path(video_id)
+        size = os.path.getsize(path)
+        sent = byte_ranges.range_for_length(size) if byte_ranges else (0, size)
+        with podtube.stream_lock:
+            podtube.stream_stats["bytes"] += sent[1] - sent[0] if sent else 0
+        return web.FileResponse(
+            path,
+            chunk_size=STREAM_CHUNK_SIZE,
+            headers={"Content-Type": "audio/mpeg", "Accept-Ranges": "bytes"},
+        )
+
+    # Players open with "Range: bytes=0-": 206 once the final size is known
+    total = await run_blocking(fill.length, podtube.MEDIA_RESOLVE_TIMEOUT) if byte_range else None
+    if total is not None:
+        satisfiable = byte_ranges.range_for_length(total)
+        if not satisfiable:
+            return web.Response(status=416, headers={"Content-Range": f"bytes */{total}"})
+        return await stream_fill_response(request, fill, *satisfiable, total)
+    if byte_range and byte_range[0] > 0:
+        return await seek_response(request, video_id, byte_ranges)
+    return await stream_fill_response(request, fill)
+
+
+def wsgi_environ(request, body):
+    """Construir el environ WSGI de una petición de aiohttp."""
+    host, _, port = (request.host or "localhost").partition(":")
+    environ = {
+        "REQUEST_METHOD": request.method,
+        "SCRIPT_NAME": "",
+        "PATH_INFO": request.path,
+        "QUERY_STRING": request.query_string,
+        "SERVER_NAME": host,
+        "SERVER_PORT": port or ("443" if request.scheme == "https" else "80"),
+        "SERVER_PROTOCOL": f"HTTP/{request.version.major}.{request.version.minor}",
+        "REMOTE_ADDR": request.remote or "",
+        "CONTENT_TYPE": request.headers.get("Content-Type", ""),
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": request.scheme,
+        "wsgi.input": BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in request.headers.items():
+        key = "HTTP_" + name.upper().replace("-", "_")
+        if key in ("HTTP_CONTENT_TYPE", "HTTP_CONTENT_LENGTH"):
+            continue
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def call_wsgi(environ, loop, started, chunks, closed):
+    """Ejecutar la aplicación Flask y pasar su respuesta al bucle de eventos.
+
+    ``started`` recibe ``(estado, cabeceras)`` y ``chunks`` cada parte del
+    cuerpo, terminando con None. Todo el cuerpo se recorre en este hilo:
+    los generadores de stream_with_context no pueden cambiar de hilo. Si el
+    cliente se va (``closed``) se deja de recorrer.
+    """
+    def put(chunk):
+        asyncio.run_coroutine_threadsafe(chunks.put(chunk), loop).result()
+
+    def resolve(method, value):
+        # El manejador puede haberse cancelado (cliente desconectado)
+        loop.call_soon_threadsafe(lambda: started.done() or method(value))
+
+    def start_response(status, headers, exc_info=None):
+        resolve(started.set_result, (status, headers))
+        return put
+
+    try:
+        result = podtube.app(environ, start_response)
+    except Exception as e:
+        resolve(started.set_exception, e)
+        return
+    try:
+        for data in result:
+            if closed.is_set():
+                break
+            if data:
+                put(data)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+        put(None)
+
+
+async def wsgi_handler(request):
+    """Pasar la petición a la aplicación Flask y enviar su respuesta por partes."""
+    body = await request.read()
+    loop = asyncio.get_running_loop()
+    started = loop.create_future()
+    chunks = asyncio.Queue(maxsize=WSGI_QUEUE_CHUNKS)
+    closed = threading.Event()
+    loop.run_in_executor(
+        request.app["wsgi_executor"], call_wsgi,
+        wsgi_environ(request, body), loop, started, chunks, closed,
+    )
+
+    try:
+        status, headers = await started
+        response = web.StreamResponse(status=int(status.split(" ", 1)[0]))
+        for name, value in headers:
+            if name.lower() == "content-length":
+                response.content_length = int(value)
+            elif name.lower() not in HOP_BY_HOP_HEADERS:
+                response.headers.add(name, value)
+        await response.prepare(request)
+
+        while (chunk := await chunks.get()) is not None:
+            await response.write(chunk)
+        await response.write_eof()
+        return response
+    finally:
+        # Desbloquear el hilo si el cliente se fue a mitad de respuesta
+        closed.set()
+        while not chunks.empty():
+            chunks.get_nowait()
+
+
+async def on_startup(application):
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=ASYNC_MEDIA_THREADS, thread_name_prefix="media")
+    )
+    application["wsgi_executor"] = ThreadPoolExecutor(
+        max_workers=ASYNC_WSGI_THREADS, thread_name_prefix="wsgi"
+    )
+    application["http"] = ClientSession(
+        connector=TCPConnector(limit=ASYNC_UPSTREAM_CONNECTIONS),
+        timeout=ClientTimeout(
+            sock_connect=podtube.YOUTUBE_API_CONNECT_TIMEOUT,
+            sock_read=podtube.YOUTUBE_API_READ_TIMEOUT,
+        ),
+        auto_decompress=False,
+    )
+
+
+async def on_cleanup(application):
+    await application["http"].close()
+    application["wsgi_executor"].shutdown(wait=False)
+
+
+def create_app():
+    application = web.Application()
+    application.router.add_get("/audio/{video_id}", stream_audio)
+    application.router.add_route("*", "/{path:.*}", wsgi_handler)
+    application.on_startup.append(on_startup)
+    application.on_response_prepare.append(on_response_prepare)
+    application.on_cleanup.append(on_cleanup)
+    return application
+
+
+if __name__ == "__main__":
+    web.run_app(
+        create_app(),
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", 5000)),
+        access_log=None,
+    )
@@ -0,0 +1,59 @@
+"""Comparar la latencia de extracción de yt-dlp: un proceso por llamada frente
+al pool de trabajadores persistentes.
+
+Uso:
+    python bench_extractor.py [URL] [-n ITERACIONES] [--pool-size N]
+"""
+import argparse
+import statistics
+import subprocess
+import time
+
+from extractor import ExtractorPool
+
+
+def time_calls(function, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name, timings):
+    print(
+        f"{name:<22} mean {statistics.mean(timings):7.3f}s  "
+        f"p50 {statistics.median(timings):7.3f}s  max {max(timings):7.3f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("url", nargs="?", default="https://www.youtube.com/watch?v=jNQXAC9IVRw")
+    parser.add_argument("-n", "--iterations", type=int, default=5)
+    parser.add_argument("--pool-size", type=int, default=1)
+    args = parser.parse_args()
+
+    def spawn():
+        subprocess.run(
+            ["yt-dlp", "-f", "bestaudio", "--no-playlist", "--skip-download", "--dump-json", args.url],
+            capture_output=True,
+            check=True,
+        )
+
+    pool = ExtractorPool(size=args.pool_size)
+
+    def pooled():
+        pool.submit("extract", args.url, {"format": "bestaudio", "noplaylist": True})
+
+    # La primera llamada al pool incluye el arranque de los trabajadores
+    cold = time_calls(pooled, 1)
+
+    report("spawn per call", time_calls(spawn, args.iterations))
+    report("pool (first call)", cold)
+    report("pool (warm)", time_calls(pooled, args.iterations))
+
+
+if __name__ == "__main__":
+    main()
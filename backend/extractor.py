@@ -0,0 +1,235 @@
+"""Pool de procesos yt-dlp persistentes.
+
+Cada trabajador es un proceso ``python extractor.py --worker`` que importa
+yt_dlp una sola vez y atiende trabajos (extracción o descarga) recibidos como
+líneas JSON por stdin, respondiendo con otra línea JSON por stdout. Así cada
+petición se ahorra el arranque del intérprete y la importación de los
+extractores.
+"""
+import json
+import logging
+import os
+import queue
+import select
+import subprocess
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Claves grandes del info dict que no se usan y no merece la pena serializar
+DROPPED_INFO_KEYS = ("formats", "thumbnails", "automatic_captions", "subtitles", "heatmap")
+
+
+class ExtractorError(Exception):
+    """Fallo de un trabajo del pool (error de yt-dlp, timeout o trabajador caído)."""
+
+
+def worker_main():
+    """Bucle de un trabajador: leer trabajos de stdin y responder por stdout."""
+    # Las respuestas van por una copia de stdout; cualquier otra salida
+    # (yt-dlp, ffmpeg) se redirige a stderr para no romper el protocolo
+    responses = os.fdopen(os.dup(1), "w", encoding="utf-8")
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+
+    import yt_dlp
+
+    for line in sys.stdin:
+        job = json.loads(line)
+        try:
+            result = None
+            if job["kind"] != "ping":
+                options = dict(
+                    job.get("options") or {},
+                    quiet=True,
+                    no_warnings=True,
+                    noprogress=True,
+                )
+                with yt_dlp.YoutubeDL(options) as ydl:
+                    info = ydl.extract_info(job["url"], download=job["kind"] == "download")
+                    result = ydl.sanitize_info(info)
+                for key in DROPPED_INFO_KEYS:
+                    result.pop(key, None)
+            response = {"ok": True, "result": result}
+        except Exception as e:
+            response = {"ok": False, "error": str(e)}
+
+        responses.write(json.dumps(response) + "\n")
+        responses.flush()
+
+
+class ExtractorWorker:
+    """Un proceso trabajador y su canal de comunicación."""
+
+    def __init__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--worker"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            bufsize=0,
+        )
+        self.jobs = 0
+        self.buffer = b""
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def call(self, job, timeout):
+        """Enviar un trabajo y esperar su respuesta como mucho ``timeout`` segundos."""
+        self.process.stdin.write((json.dumps(job) + "\n").encode("utf-8"))
+
+        deadline = time.monotonic() + timeout
+        fd = self.process.stdout.fileno()
+        while b"\n" not in self.buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"job took more than {timeout}s")
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if not ready:
+                continue
+            data = os.read(fd, 65536)
+            if not data:
+                raise EOFError("worker exited")
+            self.buffer += data
+
+        line, _, self.buffer = self.buffer.partition(b"\n")
+        return json.loads(line)
+
+    def stop(self):
+        if not self.alive():
+            return
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+class ExtractorPool:
+    """Pool acotado de trabajadores yt-dlp.
+
+    Los trabajadores se arrancan en el primer trabajo. Cada uno se recicla tras
+    ``max_jobs`` trabajos, se sustituye si supera el timeout o muere, y un
+    hilo los comprueba periódicamente con un ping mientras están libres.
+    """
+
+    def __init__(self, size=2, max_jobs=50, job_timeout=120, acquire_timeout=300,
+                 health_interval=60):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.job_timeout = job_timeout
+        self.acquire_timeout = acquire_timeout
+        self.health_interval = health_interval
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        self.started = False
+        self.stats = {
+            "spawned": 0,
+            "jobs": 0,
+            "errors": 0,
+            "timeouts": 0,
+            "crashes": 0,
+            "recycled": 0,
+        }
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            for _ in range(self.size):
+                self.idle.put(ExtractorWorker())
+            self.stats["spawned"] += self.size
+            self.started = True
+
+        thread = threading.Thread(
+            target=self.health_loop, name="extractor-health", daemon=True
+        )
+        thread.start()
+
+    def count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def replace(self, worker, stat):
+        """Parar un trabajador y devolver uno nuevo en su lugar."""
+        self.count(stat)
+        self.count("spawned")
+        worker.stop()
+        return ExtractorWorker()
+
+    def submit(self, kind, url, options=None, timeout=None):
+        """Ejecutar un trabajo (``extract`` o ``download``) y devolver el info dict.
+
+        Lanza ExtractorError si yt-dlp falla, si el trabajo supera el timeout
+        o si no hay trabajadores libres a tiempo.
+        """
+        self.start()
+        try:
+            worker = self.idle.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            raise ExtractorError("no extractor worker available")
+
+        try:
+            if not worker.alive():
+                worker = self.replace(worker, "crashes")
+            response = worker.call(
+                {"kind": kind, "url": url, "options": options},
+                timeout or self.job_timeout,
+            )
+            worker.jobs += 1
+            self.count("jobs")
+        except TimeoutError as e:
+            worker = self.replace(worker, "timeouts")
+            raise ExtractorError(str(e)) from e
+        except (EOFError, OSError, ValueError) as e:
+            worker = self.replace(worker, "crashes")
+            raise ExtractorError(f"worker failed: {e}") from e
+        finally:
+            if worker.jobs >= self.max_jobs:
+                worker = self.replace(worker, "recycled")
+            self.idle.put(worker)
+
+        if not response["ok"]:
+            self.count("errors")
+            raise ExtractorError(response["error"])
+        return response["result"]
+
+    def health_check(self):
+        """Hacer ping a los trabajadores libres y sustituir los que no respondan."""
+        checked = []
+        for _ in range(self.size):
+            try:
+                checked.append(self.idle.get_nowait())
+            except queue.Empty:
+                break
+
+        for worker in checked:
+            try:
+                if not worker.alive() or not worker.call({"kind": "ping"}, 10)["ok"]:
+                    raise EOFError("worker not responding")
+            except (TimeoutError, EOFError, OSError, ValueError):
+                worker = self.replace(worker, "crashes")
+            self.idle.put(worker)
+
+    def health_loop(self):
+        while True:
+            time.sleep(self.health_interval)
+            try:
+                self.health_check()
+            except Exception as e:
+                logger.error(f"Error comprobando los trabajadores yt-dlp: {e}")
+
+    def snapshot(self):
+        with self.lock:
+            running = self.size if self.started else 0
+            return dict(self.stats, size=self.size, running=running, idle=self.idle.qsize())
+
+
+if __name__ == "__main__" and "--worker" in sys.argv:
+    worker_main()
@@ -0,0 +1,49 @@
+"""Proceso que ejecuta la cola persistente de trabajos.
+
+Con ``JOB_QUEUE_ENABLED=true`` la aplicación web solo encola las
+actualizaciones de feeds, las descargas de episodios y las importaciones OPML
+en la tabla ``job``; este proceso las toma por prioridad y las ejecuta. Se
+pueden lanzar varios (en la misma máquina o en otras que compartan la base de
+datos). Uso::
+
+    python worker.py
+"""
+import logging
+import os
+import signal
+import threading
+
+import app as podtube
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKER_THREADS = int(os.getenv("JOB_WORKER_THREADS", 2))
+
+
+def main():
+    stop = threading.Event()
+
+    def handle_signal(signum, frame):
+        # Terminar los trabajos en curso y salir; los que no acaben a tiempo
+        # vuelven a la cola cuando caduca su bloqueo
+        logger.info(f"Signal {signum} received, stopping job worker")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    threads = [
+        threading.Thread(target=podtube.run_job_worker, args=(stop,), name=f"job-worker-{i}")
+        for i in range(JOB_WORKER_THREADS)
+    ]
+    for thread in threads:
+        thread.start()
+    logger.info(f"Job worker {podtube.LEASE_OWNER} running {JOB_WORKER_THREADS} threads")
+
+    while any(thread.is_alive() for thread in threads):
+        for thread in threads:
+            thread.join(timeout=1)
+
+
+if __name__ == "__main__":
+    main()